@@ -1,39 +1,373 @@
 import asyncio
 import itertools
 import struct
-from typing import Optional
+import time
+import zlib
+from array import array
+from typing import Callable, Iterator, Optional, Union
 
 import betterproto  # for type hints
 
 from ola.proto import (
     Ack,
+    DeviceInfo,
+    DeviceInfoReply,
+    DeviceInfoRequest,
     DmxData,
     OptionalUniverseRequest,
+    PluginInfo,
     PluginListReply,
     PluginListRequest,
+    PortInfo,
+    RegisterAction,
+    RegisterDmxRequest,
     UniverseInfoReply,
     UniverseRequest,
 )
 
 # generated by protoc using betterproto
 from ola.rpc import RpcMessage, Type
-from desk import ControllerUniverseOutput, NetNode, UniverseKey
+from events import Observable, ObservableDict
+from registration import Pollable
+from trait import Channel
+from desk import DMX_UNIVERSE_SIZE, ControllerUniverseOutput, NetNode, UniverseKey
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class OlaRpcError(Exception):
+    # olad answered a request with RESPONSE_FAILED, RESPONSE_NOT_IMPLEMENTED
+    # or the like, eg. GetDmx for a universe it does not have
+    def __init__(self, type: int, reason: str) -> None:
+        self.type = type
+        self.reason = reason
+        super().__init__(f"{Type(type).name}: {reason}")
+
+
+def _put_varint(buf: bytearray, pos: int, value: int) -> int:
+    # protobuf base 128 varint, negative int32 as 64-bit two's complement
+    value &= 0xFFFFFFFFFFFFFFFF
+    while value > 0x7F:
+        buf[pos] = (value & 0x7F) | 0x80
+        value >>= 7
+        pos += 1
+    buf[pos] = value
+    return pos + 1
+
+
+def _varint_len(value: int) -> int:
+    value &= 0xFFFFFFFFFFFFFFFF
+    n = 1
+    while value > 0x7F:
+        value >>= 7
+        n += 1
+    return n
+
+
+def _get_varint(buf: memoryview, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fields(buf: memoryview) -> Iterator[tuple[int, Union[int, memoryview]]]:
+    # (field number, value) of a protobuf message, length delimited fields as
+    # a view into buf rather than a copy
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _get_varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = _get_varint(buf, pos)
+            yield key >> 3, value
+        elif wire == 2:
+            n, pos = _get_varint(buf, pos)
+            yield key >> 3, buf[pos : pos + n]
+            pos += n
+        elif wire == 1:
+            pos += 8
+        elif wire == 5:
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire}")
+
+
+def decode_rpc(body: memoryview) -> tuple[int, int, memoryview, memoryview]:
+    # RpcMessage as type, id, name and buffer, the inverse of the framing in
+    # DmxFrameEncoder without going through betterproto
+    type = req_id = 0
+    name = buffer = body[:0]
+    for field, value in _fields(body):
+        if field == 1:
+            type = value  # type: ignore
+        elif field == 2:
+            req_id = value  # type: ignore
+        elif field == 3:
+            name = value  # type: ignore
+        elif field == 4:
+            buffer = value  # type: ignore
+    return type, req_id, name, buffer
+
+
+def decode_dmx(buf: memoryview) -> tuple[int, memoryview, int]:
+    # DmxData as universe, data and priority, data still a view into buf
+    universe = priority = 0
+    data = buf[:0]
+    for field, value in _fields(buf):
+        if field == 1:
+            universe = value  # type: ignore
+        elif field == 2:
+            data = value  # type: ignore
+        elif field == 3:
+            priority = value  # type: ignore
+    if universe >= 1 << 63:
+        universe -= 1 << 64
+    return universe, data, priority
+
+
+class DmxFrameEncoder:
+    # the hot path, a whole framed RpcMessage carrying DmxData written into one
+    # reused buffer with the universe copied in through a memoryview, no
+    # betterproto objects or intermediate bytes. Output is byte for byte what
+    # betterproto produces (see test_aio_ola.py), fields at their default value
+    # are left out the same way.
+    #
+    # The frame returned is a view into the buffer, so whoever writes it must
+    # call release() if the view may still be referenced after the write.
+    def __init__(self, size=DMX_UNIVERSE_SIZE + 64) -> None:
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._names: dict[str, bytes] = {}
+        self._data_pos = 0
+        self._data_len = 0
+
+    def release(self) -> None:
+        # the last frame is still in use (eg. queued in a transport), encode
+        # the next into a fresh buffer. A copy, so last_data stays valid
+        self._buf = bytearray(self._buf)
+        self._view = memoryview(self._buf)
+
+    def last_data(self) -> memoryview:
+        # the universe data of the last frame encoded, until the next encode
+        return self._view[self._data_pos : self._data_pos + self._data_len]
+
+    def encode(
+        self,
+        type: int,
+        req_id: int,
+        method_name: str,
+        universe: int,
+        data: Buffer,
+        priority: int = 0,
+    ) -> memoryview:
+        name = self._names.get(method_name)
+        if name is None:
+            name = self._names[method_name] = method_name.encode()
+        n = len(data)
+
+        inner = 0
+        if universe:
+            inner += 1 + _varint_len(universe)
+        if n:
+            inner += 1 + _varint_len(n) + n
+        if priority:
+            inner += 1 + _varint_len(priority)
+
+        rpc = 1 + _varint_len(type)
+        if req_id:
+            rpc += 1 + _varint_len(req_id)
+        if name:
+            rpc += 1 + _varint_len(len(name)) + len(name)
+        if inner:
+            rpc += 1 + _varint_len(inner) + inner
+
+        if 4 + rpc > len(self._buf):
+            self._buf = bytearray(4 + rpc)
+            self._view = memoryview(self._buf)
+        buf = self._buf
+
+        struct.pack_into("<L", buf, 0, (1 << 28) | rpc)
+        pos = 4
+        # RpcMessage
+        buf[pos] = 0x08
+        pos = _put_varint(buf, pos + 1, type)
+        if req_id:
+            buf[pos] = 0x10
+            pos = _put_varint(buf, pos + 1, req_id)
+        if name:
+            buf[pos] = 0x1A
+            pos = _put_varint(buf, pos + 1, len(name))
+            buf[pos : pos + len(name)] = name
+            pos += len(name)
+        if inner:
+            buf[pos] = 0x22
+            pos = _put_varint(buf, pos + 1, inner)
+        # DmxData
+        if universe:
+            buf[pos] = 0x08
+            pos = _put_varint(buf, pos + 1, universe)
+        if n:
+            buf[pos] = 0x12
+            pos = _put_varint(buf, pos + 1, n)
+            self._view[pos : pos + n] = data
+        self._data_pos = pos
+        self._data_len = n
+        pos += n
+        if priority:
+            buf[pos] = 0x18
+            pos = _put_varint(buf, pos + 1, priority)
+        return self._view[:pos]
 
 
 class OlaClient(ControllerUniverseOutput):
-    def __init__(self, host="localhost", port=9010) -> None:
+    # with streaming set, DMX frames are sent with StreamDmxData, which olad
+    # never replies to, so a frame costs a write rather than a round trip.
+    # Control RPCs still wait for their reply, at most max_in_flight at once and
+    # for no longer than timeout seconds.
+    #
+    # Streamed frames go through a queue holding the latest frame per universe.
+    # A writer task sends them and waits for the socket to drain, so if olad
+    # falls behind, a frame not yet sent is replaced by the next one for its
+    # universe (counted in coalesced) rather than piling up to play late.
+    #
+    # connect() starts a supervisor task which reconnects with exponential
+    # backoff whenever the connection drops, eg. olad restarting, and then
+    # resends the latest frame of every universe. Frames set meanwhile are only
+    # remembered, so nothing waits on the connection. The NetNode's state
+    # follows the connection and node_changed fires on each change.
+    #
+    # register_dmx asks olad to send a universe's input, which arrives as
+    # UpdateDmxData requests from olad. They are decoded in place and handed to
+    # the listeners as a memoryview, only valid during the call. Registrations
+    # are repeated on every reconnect.
+    def __init__(
+        self,
+        host="localhost",
+        port=9010,
+        streaming=True,
+        timeout=1.0,
+        max_in_flight=32,
+        write_buffer=4096,
+        min_backoff=0.1,
+        max_backoff=5.0,
+    ) -> None:
         self._handlers: dict[int, tuple[type[betterproto.Message], asyncio.Future]] = {}
         self._request_counter = itertools.count()
         self._host = host
         self._port = port
         self._writer: Optional[asyncio.StreamWriter] = None
-        self.nodes = [NetNode(name="OLA", address=f"{host}:{port}")]
+        self.streaming = streaming
+        self.timeout = timeout
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+        # request round trip time in seconds, exponentially weighted
+        self.rtt: float = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.write_buffer = write_buffer
+        self._pending: dict[int, tuple[Buffer, int]] = {}
+        self._encoders: dict[int, DmxFrameEncoder] = {}
+        # when each universe's frame in its encoder went out, for readback
+        self._written_at: dict[int, float] = {}
+        self._pending_event = asyncio.Event()
+        self.frames_sent = 0
+        self.coalesced = 0
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        # every universe's buffer as last given to set_dmx, resent on reconnect
+        self._latest: dict[int, tuple[Buffer, int]] = {}
+        self._supervisor: Optional[asyncio.Task] = None
+        self._attempted = asyncio.Event()
+        self.node = NetNode(name="OLA", address=f"{host}:{port}")
+        self.node.state = "disconnected"
+        self.nodes = [self.node]
+        self.node_changed: Observable[NetNode] = Observable()
+        self._dmx_listeners: dict[int, list[Callable[[memoryview], None]]] = {}
+        self.frames_received = 0
 
-    async def connect(self):
-        self._reader, self._writer = await asyncio.open_connection(
-            self._host, self._port
-        )
-        asyncio.create_task(self._handle_messages())
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def connect(self) -> bool:
+        # returns once the first attempt has succeeded or failed, the
+        # supervisor carries on trying in the background either way
+        if self._supervisor is None:
+            self._supervisor = asyncio.create_task(self._supervise())
+        await self._attempted.wait()
+        return self.connected
+
+    async def close(self) -> None:
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+
+    def _set_state(self, state: str) -> None:
+        if self.node.state != state:
+            self.node.state = state
+            self.node_changed.notify(self.node)
+
+    async def _supervise(self) -> None:
+        delay = self.min_backoff
+        while True:
+            self._set_state("connecting")
+            try:
+                reader, writer = await asyncio.open_connection(self._host, self._port)
+            except OSError as e:
+                self._set_state(f"retry in {delay:.1f}s: {e.strerror or e}")
+                self._attempted.set()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            delay = self.min_backoff
+            await self._run_connection(reader, writer)
+
+    async def _run_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._reader, self._writer = reader, writer
+        # the default high water mark holds seconds of frames before drain()
+        # pushes back
+        writer.transport.set_write_buffer_limits(high=self.write_buffer)
+        if self._attempted.is_set():
+            self.reconnects += 1
+        self._set_state("connected")
+        self._attempted.set()
+
+        # whatever was queued for the old connection is superseded by this
+        self._pending = dict(self._latest)
+        if self._pending:
+            self._pending_event.set()
+
+        tasks = [
+            asyncio.create_task(self._handle_messages()),
+            asyncio.create_task(self._write_frames()),
+        ]
+        register = asyncio.create_task(self._register_all())
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks + [register]:
+                task.cancel()
+            await asyncio.gather(*tasks, register, return_exceptions=True)
+            self._writer = None
+            writer.close()
+            self._fail_handlers("olad connection lost")
+            self._set_state("disconnected")
+
+    def _fail_handlers(self, reason: str) -> None:
+        for _, fut in self._handlers.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError(reason))
+        self._handlers.clear()
 
     async def _send_request(
         self,
@@ -41,18 +375,75 @@ class OlaClient(ControllerUniverseOutput):
         method_name: str,
         return_msg_class: type[betterproto.Message],
     ):
-        req_id = next(self._request_counter)
-        fut = asyncio.get_running_loop().create_future()
+        return await self._request(
+            lambda req_id: self._write(Type.REQUEST, req_id, method_name, request),
+            return_msg_class,
+        )
 
+    async def _request(
+        self,
+        write: Callable[[int], None],
+        return_msg_class: type[betterproto.Message],
+    ):
+        # write sends the request with the id it is given
+        self._waiting += 1
+        try:
+            await self._in_flight.acquire()
+        finally:
+            self._waiting -= 1
+        req_id = next(self._request_counter) & 0xFFFFFFFF
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        sent = loop.time()
+        try:
+            # stash expected return info and future for _handle_messages
+            self._handlers[req_id] = (return_msg_class, fut)
+            write(req_id)
+            # not wait_for, which on 3.11 returns the reply rather than raise
+            # if the caller is cancelled just as it arrives, and a cancelled
+            # verifier or discovery task would then carry on for good
+            done, _ = await asyncio.wait([fut], timeout=self.timeout)
+            if not done:
+                raise asyncio.TimeoutError()
+            result = fut.result()
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            # a reply arriving after a timeout finds no handler and is dropped
+            self._handlers.pop(req_id, None)
+            self._in_flight.release()
+        rtt = loop.time() - sent
+        self.rtt = rtt if self.completed == 0 else self.rtt + 0.1 * (rtt - self.rtt)
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "in_flight": len(self._handlers),
+            "waiting": self._waiting,
+            "rtt": self.rtt,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "queued": len(self._pending),
+            "frames_sent": self.frames_sent,
+            "coalesced": self.coalesced,
+            "frames_received": self.frames_received,
+        }
+
+    def _send_stream(self, request: betterproto.Message, method_name: str) -> None:
+        # STREAMING_NO_RESPONSE methods, nothing comes back so nothing to wait for
+        self._write(Type.STREAM_REQUEST, 0, method_name, request)
+
+    def _write(
+        self, type: Type, req_id: int, method_name: str, request: betterproto.Message
+    ) -> None:
         rpc_message = RpcMessage()
-        rpc_message.type = Type.REQUEST
+        rpc_message.type = type
         rpc_message.id = req_id
         rpc_message.name = method_name
         rpc_message.buffer = bytes(request)
 
-        # stash expected return info and future for _handle_messages
-        self._handlers[req_id] = (return_msg_class, fut)
-
         # prepare the 4-byte sz header and send
         rpc_bytes = bytes(rpc_message)
         h = (1 << 28) | len(rpc_bytes)
@@ -61,32 +452,138 @@ class OlaClient(ControllerUniverseOutput):
         payload = header + rpc_bytes
         # print(payload)
         if not self._writer:
-            raise IOError("Stream not connected")
+            raise ConnectionError("Stream not connected")
         self._writer.write(payload)
 
-        return await fut
+    def _write_dmx(
+        self,
+        type: Type,
+        req_id: int,
+        method_name: str,
+        universe: int,
+        data: Buffer,
+        priority: int,
+    ) -> None:
+        encoder = self._encoders.get(universe)
+        if encoder is None:
+            encoder = self._encoders[universe] = DmxFrameEncoder()
+        if not self._writer:
+            raise ConnectionError("Stream not connected")
+        self._writer.write(
+            encoder.encode(type, req_id, method_name, universe, data, priority)
+        )
+        # whatever the socket did not take is left in the transport's buffer.
+        # Before 3.12 that is a copy, from 3.12 it is the view itself, which
+        # the next encode for the universe would overwrite before it is sent
+        if self._writer.transport.get_write_buffer_size():
+            encoder.release()
+        self._written_at[universe] = time.monotonic()
 
-    async def _handle_messages(self):
+    def _queue_frame(self, universe: int, data: Buffer, priority: int) -> None:
+        if universe in self._pending:
+            self.coalesced += 1
+        self._pending[universe] = (data, priority)
+        self._pending_event.set()
+
+    async def _write_frames(self) -> None:
         while True:
-            header = await self._reader.readexactly(4)
-            header_value = struct.unpack("<L", header)[0]
-            # version = (header_value & 0xF0000000) >> 28
-            sz = header_value & 0x0FFFFFF
-            # print(f'Awaiting version {version} size {sz}')
-
-            data = await self._reader.readexactly(sz)
-            m = RpcMessage().parse(data)
-            # print(m)
-            # print(f'checking for handler for request {m.id}')
-            mtype, fut = self._handlers[m.id]
-            if m.type != Type.RESPONSE:
-                t = Type(m.type)
-                print(f"Unexpected message: {t.name}!")
-                fut.set_exception(Exception(f"Unexpected reply {t.name}"))
-            else:
-                data = mtype().parse(m.buffer)
-                # print(data)
-                fut.set_result(data)
+            await self._pending_event.wait()
+            self._pending_event.clear()
+            while self._pending:
+                # oldest universe first
+                universe = next(iter(self._pending))
+                data, priority = self._pending.pop(universe)
+                self._write_dmx(
+                    Type.STREAM_REQUEST, 0, "StreamDmxData", universe, data, priority
+                )
+                self.frames_sent += 1
+                assert self._writer is not None
+                try:
+                    await self._writer.drain()
+                except ConnectionError:
+                    return
+
+    async def _handle_messages(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(4)
+                header_value = struct.unpack("<L", header)[0]
+                # version = (header_value & 0xF0000000) >> 28
+                sz = header_value & 0x0FFFFFF
+                # print(f'Awaiting version {version} size {sz}')
+
+                data = await self._reader.readexactly(sz)
+                type, req_id, name, buffer = decode_rpc(memoryview(data))
+                if type in (Type.REQUEST, Type.STREAM_REQUEST):
+                    # olad calling us, ie. DMX input
+                    self._handle_request(type, req_id, name, buffer)
+                    continue
+                # print(f'checking for handler for request {req_id}')
+                handler = self._handlers.pop(req_id, None)
+                if handler is None or handler[1].done():
+                    # timed out already
+                    continue
+                mtype, fut = handler
+                if type != Type.RESPONSE:
+                    # olad sends the reason a request failed as the buffer
+                    reason = bytes(buffer).decode(errors="replace")
+                    fut.set_exception(OlaRpcError(type, reason))
+                else:
+                    fut.set_result(mtype().parse(bytes(buffer)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # nothing more is coming, _run_connection cleans up
+            pass
+
+    def _handle_request(
+        self, type: int, req_id: int, name: memoryview, buffer: memoryview
+    ) -> None:
+        reply = Type.RESPONSE
+        if name == b"UpdateDmxData":
+            universe, data, _ = decode_dmx(buffer)
+            self.frames_received += 1
+            for listener in self._dmx_listeners.get(universe, []):
+                listener(data)
+        else:
+            reply = Type.RESPONSE_NOT_IMPLEMENTED
+        if type == Type.REQUEST and self._writer:
+            self._write(reply, req_id, "", Ack())
+
+    async def register_dmx(
+        self, universe: int, listener: Callable[[memoryview], None]
+    ) -> Optional[Ack]:
+        # listener(data) is called with each frame of input on universe
+        first = universe not in self._dmx_listeners
+        self._dmx_listeners.setdefault(universe, []).append(listener)
+        if not first or not self._writer:
+            # already registered, or will be on connecting
+            return None
+        return await self._register(universe, RegisterAction.REGISTER)
+
+    async def unregister_dmx(
+        self, universe: int, listener: Callable[[memoryview], None]
+    ) -> Optional[Ack]:
+        listeners = self._dmx_listeners.get(universe, [])
+        listeners.remove(listener)
+        if listeners or not self._writer:
+            return None
+        del self._dmx_listeners[universe]
+        return await self._register(universe, RegisterAction.UNREGISTER)
+
+    async def _register(self, universe: int, action: RegisterAction):
+        request = RegisterDmxRequest(universe=universe, action=action)
+        return await self._send_request(request, "RegisterForDmx", Ack)
+
+    async def _register_all(self) -> None:
+        for universe in list(self._dmx_listeners):
+            try:
+                await self._register(universe, RegisterAction.REGISTER)
+            except asyncio.TimeoutError:
+                print(f"olad did not register universe {universe} for input")
+            except OlaRpcError as e:
+                # carry on with the rest, this one stays dead until reconnected
+                print(
+                    f"olad did not register universe {universe} for input, {e.reason}"
+                )
 
     async def get_plugin_list(self):
         request = PluginListRequest()
@@ -96,26 +593,407 @@ class OlaClient(ControllerUniverseOutput):
         request = OptionalUniverseRequest()
         return await self._send_request(request, "GetUniverseInfo", UniverseInfoReply)
 
+    async def get_device_info(self, plugin_id=0):
+        # plugin_id 0 is every plugin
+        request = DeviceInfoRequest(plugin_id=plugin_id)
+        return await self._send_request(request, "GetDeviceInfo", DeviceInfoReply)
+
     async def get_dmx(self, universe=0):
         request = UniverseRequest()
         request.universe = universe
         return await self._send_request(request, "GetDmx", DmxData)
 
     async def set_dmx(
-        self, universe: UniverseKey, data: bytes = b"\0\0", priority: int = 0
+        self, universe: UniverseKey, data: Buffer = b"\0\0", priority: int = 0
     ):
-        if not self._writer:
-            return
         uint = int(universe)
-        request = DmxData()
-        request.universe = uint
-        request.data = data
-        request.priority = priority
-        return await self._send_request(request, "UpdateDmxData", Ack)
+        self._latest[uint] = (data, priority)
+        if not self._writer:
+            return None
+        if self.streaming:
+            # not copied, the writer encodes whatever the buffer holds when it
+            # gets to it, which is the newest frame for the universe anyway
+            self._queue_frame(uint, data, priority)
+            return None
+        try:
+            return await self._request(
+                lambda req_id: self._write_dmx(
+                    Type.REQUEST, req_id, "UpdateDmxData", uint, data, priority
+                ),
+                Ack,
+            )
+        except (asyncio.TimeoutError, ConnectionError):
+            # the next frame supersedes this one anyway, timeouts are counted
+            # and a lost connection is the supervisor's to sort out
+            return None
+
+    async def readback(self, universe: int) -> Optional[tuple[bytes, bytes, float]]:
+        # the frame last written for universe, what GetDmx says olad has and
+        # the time from writing the frame to the reply. olad handles a
+        # connection's messages in order so the two should match. None while
+        # frames are queued or requests waiting, readback never gets in the
+        # way of the show
+        encoder = self._encoders.get(universe)
+        if (
+            encoder is None
+            or not self._writer
+            or self._pending
+            or self._waiting
+            or self._in_flight.locked()
+        ):
+            return None
+        # the semaphore is free, so get_dmx writes its request without
+        # yielding and no frame can go out in between
+        expected = bytes(encoder.last_data())
+        written_at = self._written_at[universe]
+        reply = await self.get_dmx(universe)
+        return expected, reply.data, time.monotonic() - written_at
 
     def get_nodes(self) -> list[NetNode]:
         return self.nodes
 
+    def __repr__(self):
+        return (
+            f"OlaClient({self._host}:{self._port} {self.node.state}"
+            f" in_flight={len(self._handlers)}"
+            f" waiting={self._waiting} rtt={self.rtt * 1000:.1f}ms"
+            f" timeouts={self.timeouts} coalesced={self.coalesced})"
+        )
+
+
+class OlaClientPool(ControllerUniverseOutput):
+    # n connections to olad, each universe always sent over the same one
+    # (crc32 of the universe number), so a big frame only queues behind frames
+    # of its own shard and each connection reads and writes on its own tasks.
+    # Control RPCs go over the first connection.
+    def __init__(self, host="localhost", port=9010, connections=4, **kwargs) -> None:
+        self.clients = [
+            OlaClient(host=host, port=port, **kwargs) for _ in range(connections)
+        ]
+        self.node_changed: Observable[NetNode] = Observable()
+        for i, client in enumerate(self.clients):
+            client.node.name = f"OLA-{i}"
+            client.node_changed.sub(self.node_changed.notify)
+
+    def shard(self, universe: UniverseKey) -> OlaClient:
+        h = zlib.crc32(str(int(universe)).encode())
+        return self.clients[h % len(self.clients)]
+
+    async def connect(self) -> bool:
+        connected = await asyncio.gather(*[c.connect() for c in self.clients])
+        return all(connected)
+
+    async def close(self) -> None:
+        await asyncio.gather(*[c.close() for c in self.clients])
+
+    async def set_dmx(
+        self, universe: UniverseKey, data: Buffer = b"\0\0", priority: int = 0
+    ):
+        return await self.shard(universe).set_dmx(universe, data, priority)
+
+    async def get_plugin_list(self):
+        return await self.clients[0].get_plugin_list()
+
+    async def get_universes(self):
+        return await self.clients[0].get_universes()
+
+    async def get_device_info(self, plugin_id=0):
+        return await self.clients[0].get_device_info(plugin_id)
+
+    async def get_dmx(self, universe=0):
+        return await self.shard(universe).get_dmx(universe)
+
+    async def register_dmx(
+        self, universe: int, listener: Callable[[memoryview], None]
+    ) -> Optional[Ack]:
+        return await self.shard(universe).register_dmx(universe, listener)
+
+    async def unregister_dmx(
+        self, universe: int, listener: Callable[[memoryview], None]
+    ) -> Optional[Ack]:
+        return await self.shard(universe).unregister_dmx(universe, listener)
+
+    def get_nodes(self) -> list[NetNode]:
+        return [c.node for c in self.clients]
+
+    def stats(self) -> dict[str, float]:
+        total: dict[str, float] = {}
+        for c in self.clients:
+            for k, v in c.stats().items():
+                total[k] = total.get(k, 0) + v
+        total["rtt"] = max(c.rtt for c in self.clients)
+        return total
+
+
+class ReadbackVerifier(Pollable):
+    # reads every universe back from olad with GetDmx, one universe every
+    # interval / universes seconds, and compares it with the frame last sent.
+    # Catches olad quietly outputting something else, eg. after a plugin or
+    # patch change or a merge with another source. Runs as its own task,
+    # started on the first tick, and skips a sample rather than queue behind
+    # DMX frames.
+    #
+    #   controller.add_pollable(ReadbackVerifier(client, interval=5))
+    def __init__(self, output: Union[OlaClient, OlaClientPool], interval=2.0) -> None:
+        if isinstance(output, OlaClientPool):
+            self.clients = output.clients
+        else:
+            self.clients = [output]
+        self.interval = interval
+        self.checks = 0
+        self.mismatches = 0
+        self.skipped = 0
+        # send to readback in seconds, exponentially weighted, and worst seen
+        self.latency: float = 0
+        self.max_latency: float = 0
+        # universe -> first slot that differed, while it still does
+        self.mismatched: dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def tick(self, showtime: float) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            universes = sorted(u for c in self.clients for u in c._encoders)
+            if not universes:
+                await asyncio.sleep(self.interval)
+            for universe in universes:
+                await asyncio.sleep(self.interval / len(universes))
+                await self.check(universe)
+
+    async def check(self, universe: int) -> Optional[bool]:
+        client = next((c for c in self.clients if universe in c._encoders), None)
+        if client is None:
+            return None
+        try:
+            result = await client.readback(universe)
+        except (asyncio.TimeoutError, ConnectionError):
+            result = None
+        except OlaRpcError as e:
+            # olad lost the universe altogether, eg. after a reconfiguration
+            self.checks += 1
+            self._mismatch(universe, 0, f"reads back failed, {e.reason}")
+            return False
+        if result is None:
+            self.skipped += 1
+            return None
+
+        expected, got, latency = result
+        self.checks += 1
+        if got == expected:
+            if self.max_latency == 0:
+                self.latency = latency
+            else:
+                self.latency += 0.1 * (latency - self.latency)
+            self.max_latency = max(self.max_latency, latency)
+            if self.mismatched.pop(universe, None) is not None:
+                print(f"universe {universe} reads back correctly again")
+            return True
+
+        slot = next(
+            (i for i, (a, b) in enumerate(zip(expected, got)) if a != b),
+            min(len(expected), len(got)),
+        )
+        self._mismatch(
+            universe,
+            slot,
+            f"reads back wrong from slot {slot}:"
+            f" sent {expected[slot : slot + 8].hex()}"
+            f" olad has {got[slot : slot + 8].hex()}",
+        )
+        return False
+
+    def _mismatch(self, universe: int, slot: int, message: str) -> None:
+        self.mismatches += 1
+        if universe not in self.mismatched:
+            print(f"universe {universe} {message}")
+        self.mismatched[universe] = slot
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "checks": self.checks,
+            "mismatches": self.mismatches,
+            "skipped": self.skipped,
+            "latency": self.latency,
+            "max_latency": self.max_latency,
+        }
+
+    def __repr__(self):
+        return (
+            f"ReadbackVerifier(checks={self.checks} mismatches={self.mismatches}"
+            f" skipped={self.skipped} latency={self.latency * 1000:.1f}ms"
+            f" max={self.max_latency * 1000:.1f}ms"
+            f" wrong={sorted(self.mismatched)})"
+        )
+
+
+class OlaDiscovery(Pollable):
+    # olad's devices as NetNodes in Controller.nodes, named after the device
+    # with the plugin as state and the patched ports with their universes.
+    # Devices and universes are asked for every interval seconds, plugins only
+    # change on a reload so their names are kept for plugin_ttl. Each round is
+    # diffed against the last, so nodes are only added, changed or removed
+    # when they actually do, and the node table redraws just those rows.
+    # Runs as its own task started on the first tick, over the control
+    # connection, and skips rounds while olad is not connected.
+    #
+    #   controller.add_pollable(OlaDiscovery(client, controller.nodes))
+    def __init__(
+        self,
+        output: Union[OlaClient, OlaClientPool],
+        nodes: ObservableDict[NetNode, None],
+        interval=5.0,
+        plugin_ttl=60.0,
+    ) -> None:
+        if isinstance(output, OlaClientPool):
+            self.client = output.clients[0]
+        else:
+            self.client = output
+        self.nodes = nodes
+        self.interval = interval
+        self.plugin_ttl = plugin_ttl
+        self.rounds = 0
+        self._plugins: dict[int, PluginInfo] = {}
+        self._plugins_at: Optional[float] = None
+        # device key -> node, and the row it was last shown with
+        self._nodes: dict[str, NetNode] = {}
+        self._rows: dict[str, tuple[str, str, list[str], str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[str] = None
+
+    def tick(self, showtime: float) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            if self.client.connected:
+                try:
+                    await self.discover()
+                    self._error = None
+                except (asyncio.TimeoutError, ConnectionError, OlaRpcError) as e:
+                    # eg. an olad too old for GetDeviceInfo, tried again next round
+                    if self._error is None:
+                        print(f"OLA discovery failed: {e!r}")
+                    self._error = repr(e)
+            await asyncio.sleep(self.interval)
+
+    async def _get_plugins(self, wanted: set[int]) -> dict[int, PluginInfo]:
+        now = time.monotonic()
+        if (
+            self._plugins_at is None
+            or now - self._plugins_at > self.plugin_ttl
+            or not wanted <= self._plugins.keys()
+        ):
+            reply = await self.client.get_plugin_list()
+            self._plugins = {p.plugin_id: p for p in reply.plugin}
+            self._plugins_at = now
+        return self._plugins
+
+    async def discover(self) -> None:
+        devices = (await self.client.get_device_info()).device
+        universes = {
+            u.universe: u.name for u in (await self.client.get_universes()).universe
+        }
+        plugins = await self._get_plugins({d.plugin_id for d in devices})
+        self.rounds += 1
+
+        seen = set()
+        for device in devices:
+            key = device.device_id or f"{device.plugin_id}:{device.device_alias}"
+            seen.add(key)
+            plugin = plugins.get(device.plugin_id)
+            row = (
+                f"{self.client.node.address} #{device.device_alias}",
+                device.device_name,
+                self._ports(device, universes),
+                plugin.name if plugin else f"plugin {device.plugin_id}",
+            )
+            if self._rows.get(key) == row:
+                continue
+            node = self._nodes.get(key)
+            if node is None:
+                node = self._nodes[key] = NetNode()
+            node.address, node.name, node.ports, node.state = row
+            self._rows[key] = row
+            # notifies nodes.added or nodes.changed
+            self.nodes[node] = None
+
+        for key in list(self._nodes.keys() - seen):
+            node = self._nodes.pop(key)
+            del self._rows[key]
+            if node in self.nodes:
+                del self.nodes[node]
+
+    def _ports(self, device: DeviceInfo, universes: dict[int, str]) -> list[str]:
+        ports: list[str] = []
+        for direction, port_list in (
+            ("in", device.input_port),
+            ("out", device.output_port),
+        ):
+            for port in port_list:
+                if port.active:
+                    ports.append(self._port(direction, port, universes))
+        return ports
+
+    def _port(self, direction: str, port: PortInfo, universes: dict[int, str]) -> str:
+        name = universes.get(port.universe)
+        universe = f"{port.universe} {name}" if name else str(port.universe)
+        return f"{direction}{port.port_id}:{universe}"
+
+
+class DmxInput(Pollable):
+    # drives Channel traits from slots of an input universe, eg. the faders of
+    # an external console. A frame only has its bound slots compared against
+    # the last frame, and changes are set on the controller's next tick, so
+    # EFX see them at most one frame late and traits are never set part way
+    # through a tick.
+    #
+    #   desk = DmxInput()
+    #   desk.bind(0, efx.speed)                   # first slot of the universe
+    #   await client.register_dmx(5, desk.on_dmx)
+    #   controller.add_pollable(desk)
+    def __init__(self) -> None:
+        self._offset = array("I")
+        self._last = array("h")
+        self._channels: list[Channel] = []
+        self._pending: dict[int, int] = {}
+
+    def bind(self, offset: int, channel: Channel) -> None:
+        self._offset.append(offset)
+        self._last.append(-1)
+        self._channels.append(channel)
+
+    def on_dmx(self, data: memoryview) -> None:
+        n = len(data)
+        last = self._last
+        for k, offset in enumerate(self._offset):
+            # slots past the end of a short frame read as zero
+            v = data[offset] if offset < n else 0
+            if v != last[k]:
+                last[k] = v
+                self._pending[k] = v
+
+    def tick(self, showtime: float) -> None:
+        for k, v in self._pending.items():
+            channel = self._channels[k]
+            channel.set(v * channel.pos_max // 255)
+        self._pending.clear()
+
 
 async def main():
     client = OlaClient()
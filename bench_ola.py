@@ -0,0 +1,126 @@
+# End to end DMX output benchmark, OlaClient and OlaClientPool against the olad
+# stand-in running in another process. Each tick stamps its number into every
+# universe and hands them all to set_dmx, the stand-in records when each frame
+# arrives, giving the tick rate kept up and the tick-to-wire latency.
+#
+#   python bench_ola.py --universes 64 --ticks 400 --fps 44
+#   python bench_ola.py --fps 0          # as fast as the event loop allows
+
+import argparse
+import asyncio
+import multiprocessing
+import struct
+import time
+from multiprocessing.connection import Connection
+from typing import Callable
+
+from aio_ola import OlaClient, OlaClientPool
+from olad_standin import OladStandin
+
+STAMP = struct.Struct(">I")
+
+
+def standin(port: int, ack_delay: float, jitter: float, conn: Connection) -> None:
+    # serves until asked for the arrivals, then sends them and starts afresh
+    async def serve():
+        olad = OladStandin(ack_delay=ack_delay, jitter=jitter, tag=STAMP.size)
+        await olad.start(port=port)
+        loop = asyncio.get_running_loop()
+        conn.send("ready")
+        while await loop.run_in_executor(None, conn.recv) == "arrivals":
+            conn.send(olad.arrivals)
+            olad.reset()
+        await olad.close()
+
+    asyncio.run(serve())
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def run(
+    output: OlaClient | OlaClientPool, universes: int, ticks: int, fps: float
+) -> tuple[float, list[float]]:
+    await output.connect()
+    data = [bytearray(512) for _ in range(universes)]
+    sent_at: list[float] = []
+    start = time.monotonic()
+    for tick in range(ticks):
+        if fps:
+            # paced like Controller.run, sleeping until the tick is due
+            await asyncio.sleep(max(0, start + tick / fps - time.monotonic()))
+        sent_at.append(time.monotonic())
+        for u in range(universes):
+            STAMP.pack_into(data[u], 0, tick)
+            await output.set_dmx(u + 1, data[u])
+        if not fps:
+            # let the writers run
+            await asyncio.sleep(0)
+    elapsed = time.monotonic() - start
+    while any(c._pending for c in clients_of(output)):
+        await asyncio.sleep(0.001)
+    # allow the last writes to land
+    await asyncio.sleep(0.05)
+    await output.close()
+    return ticks / elapsed, sent_at
+
+
+def clients_of(output):
+    return output.clients if isinstance(output, OlaClientPool) else [output]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OLA output throughput and latency")
+    parser.add_argument("--universes", type=int, default=64)
+    parser.add_argument("--ticks", type=int, default=400)
+    parser.add_argument("--fps", type=float, default=44, help="0 for flat out")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--ack-delay", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=19010)
+    args = parser.parse_args()
+
+    conn, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=standin,
+        args=(args.port, args.ack_delay, args.jitter, child),
+        daemon=True,
+    )
+    server.start()
+    conn.recv()
+
+    outputs: dict[str, Callable[[], OlaClient | OlaClientPool]] = {
+        "single": lambda: OlaClient(port=args.port),
+        f"pool x{args.connections}": lambda: OlaClientPool(
+            port=args.port, connections=args.connections
+        ),
+    }
+    wanted = args.universes * args.ticks
+    print(f"{args.universes} universes x {args.ticks} ticks at {args.fps or 'max'} fps")
+    for name, make in outputs.items():
+        fps, sent_at = asyncio.run(run(make(), args.universes, args.ticks, args.fps))
+        conn.send("arrivals")
+        arrivals = conn.recv()
+        latency = [
+            t - sent_at[STAMP.unpack(stamp)[0]]
+            for frames in arrivals.values()
+            for t, stamp in frames
+        ]
+        delivered = len(latency)
+        print(
+            f"{name:>10}: {fps:8.1f} ticks/s,"
+            f" latency p50 {percentile(latency, 50) * 1000:6.2f}ms"
+            f" p99 {percentile(latency, 99) * 1000:6.2f}ms"
+            f" max {max(latency, default=0) * 1000:6.2f}ms,"
+            f" {delivered}/{wanted} frames delivered"
+        )
+    conn.send("stop")
+    server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,10 @@ class ChannelProp(ABC):
         self.pos = pos
         self.data: Optional[UniverseType] = None
         self.base = 0
+        # whatever last set pos, and while a modulation source is moving pos the
+        # value it moves around, which is what presets save
+        self.source: Any = None
+        self.held: Optional[int] = None
 
     def patch(self, data: UniverseType, base: int) -> None:
         self.data = data
@@ -23,6 +27,8 @@ class ChannelProp(ABC):
         np = min(self.pos_max, max(self.pos_min, int(value)))
         changed = np != self.pos
         self.pos = np
+        self.source = source
+        self.held = None
         if changed:
             self._write_dmx()
         return changed
@@ -32,10 +38,10 @@ class ChannelProp(ABC):
         pass
 
     def add_state(self, key: str, d: Dict[str, Any]):
-        d[key] = self.pos
+        d[key] = self.pos if self.held is None else self.held
 
     def add_global(self, key: str, d: Dict[str, Any]):
-        d[key] = self.pos
+        d[key] = self.pos if self.held is None else self.held
 
 
 class ByteChannelProp(ChannelProp):
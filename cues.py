@@ -0,0 +1,194 @@
+from array import array
+from typing import Any, Dict, List, Optional, Union
+
+from desk import Controller
+from playback import ChannelIndex, Compiled, Timeline
+from registration import Pollable
+
+# Cues are compiled against the controller's ChannelIndex when loaded. A GO then
+# only turns the compiled arrays into timeline segments, and each tick evaluates
+# the active segments without touching the cue state dicts.
+
+
+class Cue:
+    # state is a preset name or a state dict. Channels rising take fade_in
+    # seconds, falling take fade_out (default the same as fade_in), both after
+    # delay seconds. If follow is set the next cue is triggered that many
+    # seconds after this one.
+    def __init__(
+        self,
+        state: Union[str, Dict[str, Any]],
+        fade_in: float = 0,
+        fade_out: Optional[float] = None,
+        delay: float = 0,
+        follow: Optional[float] = None,
+        name: Optional[str] = None,
+    ) -> None:
+        self.state = state
+        self.fade_in = fade_in
+        self.fade_out = fade_in if fade_out is None else fade_out
+        self.delay = delay
+        self.follow = follow
+        self.name = name
+
+    def __repr__(self):
+        return f"Cue({self.name!r}, in={self.fade_in} out={self.fade_out} delay={self.delay})"
+
+
+class CueStack(Pollable):
+    def __init__(self, controller: Controller, cues: List[Cue] = []) -> None:
+        self.controller = controller
+        self.cues: List[Cue] = []
+        self.current: Optional[int] = None
+        self._compiled: List[Compiled] = []
+        self._index: Optional[ChannelIndex] = None
+        self._go_time: float = 0
+        self._timeline: Optional[Timeline] = None
+        for cue in cues:
+            self.add_cue(cue)
+
+    def __len__(self) -> int:
+        return len(self.cues)
+
+    def add_cue(self, cue: Cue) -> int:
+        if self._index not in (None, self.controller.channel_index()):
+            self.compile()
+        self.cues.append(cue)
+        self._compiled.append(self._compile(cue))
+        return len(self.cues) - 1
+
+    def compile(self) -> None:
+        # happens again by itself if fixtures or EFX have been added since
+        self._compiled = [self._compile(cue) for cue in self.cues]
+
+    def _compile(self, cue: Cue) -> Compiled:
+        self._index = self.controller.channel_index()
+        if isinstance(cue.state, str):
+            return self.controller.compiled_preset(cue.state)
+        return self.controller.compile_state(cue.state)
+
+    def _stale(self) -> bool:
+        # compiled_preset hands back the same arrays until the preset is saved
+        # over, so a cue naming a preset picks up the new levels on its next GO
+        if self._index is not self.controller.channel_index():
+            return True
+        return any(
+            isinstance(cue.state, str)
+            and self.controller.compiled_preset(cue.state) is not compiled
+            for cue, compiled in zip(self.cues, self._compiled)
+        )
+
+    def _get_timeline(self) -> Timeline:
+        index = self.controller.channel_index()
+        if self._stale():
+            self.compile()
+        if self._timeline is None:
+            self._timeline = Timeline(index)
+        else:
+            self._timeline.rebase(index)
+        return self._timeline
+
+    def go(self, now: Optional[float] = None) -> Optional[int]:
+        n = 0 if self.current is None else self.current + 1
+        if n >= len(self.cues):
+            return None
+        self._run_cue(n, now, jump=False)
+        return n
+
+    def goto(self, n: int, now: Optional[float] = None) -> None:
+        self._run_cue(n, now, jump=True)
+
+    def _jump_state(self, n: int) -> Compiled:
+        return self._compiled[n]
+
+    def _run_cue(self, n: int, now: Optional[float], jump: bool) -> None:
+        if now is None:
+            now = self.controller.showtime
+        timeline = self._get_timeline()
+        idx, targets = self._jump_state(n) if jump else self._compiled[n]
+        self._fade(timeline, now, self.cues[n], idx, targets)
+        self.current = n
+        self._go_time = now
+
+    def _fade(
+        self, timeline: Timeline, now: float, cue: Cue, idx: array, targets: array
+    ) -> None:
+        current = timeline.index.values(idx)
+        durations = [
+            cue.fade_in if v1 >= v0 else cue.fade_out
+            for v0, v1 in zip(current, targets)
+        ]
+        timeline.add(now, idx, targets, [cue.delay] * len(idx), durations)
+        # zero time cues are applied straight away
+        timeline.evaluate(now)
+
+    def tick(self, showtime: float) -> None:
+        if self.current is not None:
+            follow = self.cues[self.current].follow
+            if follow is not None and showtime >= self._go_time + follow:
+                self.go(self._go_time + follow)
+        if self._timeline is not None and len(self._timeline):
+            self._timeline.evaluate(showtime)
+
+
+UNSET = -1
+
+
+class TrackingCueList(CueStack):
+    # theatre style tracking: each cue holds only the channels it changes, the
+    # rest carry over from earlier cues. GO fades just those deltas. A jump with
+    # goto needs the whole tracked state, which is rebuilt from the nearest
+    # checkpoint (a full copy kept every checkpoint_every cues) so the cost does
+    # not grow with the cue number.
+    def __init__(
+        self, controller: Controller, cues: List[Cue] = [], checkpoint_every=32
+    ) -> None:
+        self.checkpoint_every = checkpoint_every
+        self._checkpoints: List[array] = []
+        self._tracked = array("i")
+        super().__init__(controller, cues)
+
+    def add_cue(self, cue: Cue) -> int:
+        n = super().add_cue(cue)
+        self._track(n)
+        return n
+
+    def record(self, **kwargs) -> int:
+        # add a cue holding whatever differs from the end of the list
+        index = self.controller.channel_index()
+        if self._index is not index:
+            self.compile()
+        idx, values = self.controller.compile_state(self.controller.get_state_as_dict())
+        tracked = self._tracked if len(self.cues) else array("i", [UNSET] * len(index))
+        changed = [k for k, (i, v) in enumerate(zip(idx, values)) if tracked[i] != v]
+        delta = index.to_state([idx[k] for k in changed], [values[k] for k in changed])
+        return self.add_cue(Cue(delta, **kwargs))
+
+    def compile(self) -> None:
+        super().compile()
+        self._checkpoints = []
+        for n in range(len(self.cues)):
+            self._track(n)
+
+    def _track(self, n: int) -> None:
+        if n == 0:
+            self._tracked = array("i", [UNSET] * len(self.controller.channel_index()))
+        tracked = self._tracked
+        idx, values = self._compiled[n]
+        for i, v in zip(idx, values):
+            tracked[i] = v
+        if n % self.checkpoint_every == 0:
+            self._checkpoints.append(array("i", tracked))
+
+    def tracked_state(self, n: int) -> Compiled:
+        k = self.checkpoint_every
+        state = array("i", self._checkpoints[n // k])
+        for m in range(n - n % k + 1, n + 1):
+            idx, values = self._compiled[m]
+            for i, v in zip(idx, values):
+                state[i] = v
+        idx = array("I", [i for i, v in enumerate(state) if v != UNSET])
+        return idx, array("i", [state[i] for i in idx])
+
+    def _jump_state(self, n: int) -> Compiled:
+        return self.tracked_state(n)
@@ -5,7 +5,7 @@ import math
 import os
 import time
 from collections import defaultdict
-from typing import List, Optional, Dict, Any, Sequence
+from typing import List, Optional, Dict, Any, Sequence, TypeVar
 import itertools
 from abc import ABC
 
@@ -28,13 +28,19 @@ from registration import (
     ThingWithTraits,
     Pollable,
 )
-from trait import Channel, PTPos
+from trait import Channel, PTPos, Trait
 from events import ObservableDict
+from tempo import TempoClock
+from playback import ChannelIndex, Compiled, Timeline
+from layers import LayerStack
+from stages import OutputStage
 
 DMX_UNIVERSE_SIZE = 512
 
 UniverseKey = int | str
 
+S = TypeVar("S", bound=OutputStage)
+
 
 @register_efx
 class WavePT_EFX(EFX):
@@ -76,13 +82,15 @@ class NetNode:
         self.name = name
         self.address = address
         self.ports = []
+        # connection state, for outputs that have one
+        self.state = ""
 
 
 class ControllerUniverseOutput(ABC):
     async def set_dmx(self, universe: UniverseKey, buffer: bytes | bytearray):
         pass
 
-    async def connect(self, controller: "Controller"):
+    async def connect(self):
         pass
 
     def get_nodes(self) -> List[NetNode]:
@@ -96,7 +104,10 @@ class Controller:
         self.fixtures: List[Fixture] = []
         self.pollable: List[Pollable] = []
         self.efx: List[EFX] = []
-        self.init = time.time()
+        self.layer_stacks: List[LayerStack] = []
+        self.output_stages: List[OutputStage] = []
+        self.clock = time.time
+        self.init = self.clock()
         self.frames: int = 0
         self.fps: float = 0
         self.target_fps = 1 / self._update_interval * 1000
@@ -104,35 +115,67 @@ class Controller:
         self.universes: dict[UniverseKey, bytearray] = {}
         self.blackout = False
         self._blackout_buffer = bytes(DMX_UNIVERSE_SIZE)
+        # what is actually sent when there are output stages
+        self._frames: dict[UniverseKey, bytearray] = {}
         self.prefix_counter: Dict[str, itertools.count] = defaultdict(itertools.count)
         self.objects_by_name: Dict[str, ThingWithTraits] = {}
         self.presets: dict[str, Any] = {}
         self.showfile_name: Optional[str] = None
         self.nodes: ObservableDict[NetNode, None] = ObservableDict()
+        self.tempo = TempoClock()
+        self._channel_index: Optional[ChannelIndex] = None
+        self._compiled_presets: Dict[str, tuple[Any, Compiled]] = {}
+        self._preset_fade: Optional[Timeline] = None
 
     async def run(self) -> None:
         self._conn_task = [asyncio.create_task(o.connect()) for o in self.outputs]
 
         while True:
-            before = time.time()
+            before = self.clock()
             await self._tick_once(before)
             next_tick = before + self._update_interval / 1000.0
-            await asyncio.sleep(next_tick - time.time())
+            await asyncio.sleep(next_tick - self.clock())
 
     async def _tick_once(self, showtime: float) -> None:
+        tick_started = self.clock()
         self.showtime = showtime - self.init
         self.frames += 1
         self.fps = self.frames / self.showtime
 
+        # once per frame, shared by every EFX
+        self.tempo.tick(self.showtime)
+
+        if self._preset_fade is not None and len(self._preset_fade):
+            self._preset_fade.evaluate(self.showtime)
+
         for pollable in self.pollable + self.efx:
             pollable.tick(self.showtime)
 
+        for stack in self.layer_stacks:
+            stack.composite()
+
+        frames = self.universes
+        if self.output_stages:
+            frames = self._output_frames()
+            # the time the frame goes out, rather than when the tick started
+            frame_time = self.showtime + max(0.0, self.clock() - tick_started)
+            for stage in self.output_stages:
+                stage.process(frames, frame_time)
+
         # Send the DMX data
         for o in self.outputs:
-            for universe, data in self.universes.items():
+            for universe, data in frames.items():
                 d = self._blackout_buffer if self.blackout else data
                 await o.set_dmx(universe, d)
 
+    def _output_frames(self) -> dict[UniverseKey, bytearray]:
+        for universe, data in self.universes.items():
+            frame = self._frames.get(universe)
+            if frame is None:
+                frame = self._frames[universe] = bytearray(DMX_UNIVERSE_SIZE)
+            frame[:] = data
+        return self._frames
+
     def _own_and_name(self, thing: ThingWithTraits) -> str:
         # take ownership and provide unique name
         uid = thing.name
@@ -142,6 +185,8 @@ class Controller:
             uid = f"{name}-{prefix_count}"
             thing.set_owner_name(self, uid)
             self.objects_by_name[uid] = thing
+            self._channel_index = None
+            self._compiled_presets.clear()
         return uid
 
     def add_fixture(
@@ -168,6 +213,8 @@ class Controller:
         fixture.patch(universe, base, data=univ)
         if fixture.base != base:
             raise ValueError("fixture.patch did not call superclass")
+        for stage in self.output_stages:
+            stage.invalidate()
 
     def _get_universe(self, universe: UniverseKey) -> bytearray:
         if universe not in self.universes:
@@ -176,11 +223,31 @@ class Controller:
 
     def add_efx(self, efx: EFX) -> str:
         uid = self._own_and_name(efx)
+        efx.tempo = self.tempo
         self.efx.append(efx)
         return uid
 
+    def add_layer_stack(self, target: Trait) -> LayerStack:
+        stack = LayerStack(target)
+        self.layer_stacks.append(stack)
+        return stack
+
+    def add_output_stage(self, stage: S) -> S:
+        stage.attach(self)
+        self.output_stages.append(stage)
+        return stage
+
     def add_network(self, output: ControllerUniverseOutput) -> None:
         self.outputs.append(output)
+        for node in output.get_nodes():
+            self.nodes[node] = None
+        node_changed = getattr(output, "node_changed", None)
+        if node_changed is not None:
+            node_changed.sub(self._node_changed)
+
+    def _node_changed(self, node: NetNode) -> None:
+        # notifies nodes.changed
+        self.nodes[node] = None
 
     def add_pollable(self, pollable: Pollable):
         self.pollable.append(pollable)
@@ -224,8 +291,44 @@ class Controller:
     def save_preset(self, name: str) -> None:
         self.presets[name] = self.get_state_as_dict()
 
-    def load_preset(self, name: str) -> None:
-        self.set_state_from_dict(self.presets[name])
+    def channel_index(self) -> ChannelIndex:
+        if self._channel_index is None:
+            self._channel_index = ChannelIndex(self.objects_by_name)
+        return self._channel_index
+
+    def compile_state(self, state: Dict[str, Any]) -> Compiled:
+        return self.channel_index().compile(state)
+
+    def compiled_preset(self, name: str) -> Compiled:
+        # recompiled only if the preset has been saved over since
+        preset = self.presets[name]
+        cached = self._compiled_presets.get(name)
+        if cached is None or cached[0] is not preset:
+            cached = (preset, self.compile_state(preset))
+            self._compiled_presets[name] = cached
+        return cached[1]
+
+    def load_preset(
+        self, name: str, fade: float = 0, easing: str = "linear", snap_at: float = 0.5
+    ) -> None:
+        # with a fade time, channels move from where they are now to the preset
+        # over the following ticks. Indexed channels (wheels, gobos) jump when
+        # snap_at of the fade has passed.
+        idx, values = self.compiled_preset(name)
+        index = self.channel_index()
+        if self._preset_fade is not None:
+            self._preset_fade.rebase(index)
+        if fade <= 0:
+            if self._preset_fade is not None:
+                self._preset_fade.clear()
+            index.apply(idx, values)
+            return
+        if self._preset_fade is None:
+            self._preset_fade = Timeline(index)
+        self._preset_fade.set_easing(easing)
+        self._preset_fade.snap_at = snap_at
+        zeros = [0.0] * len(idx)
+        self._preset_fade.add(self.showtime, idx, values, zeros, [fade] * len(idx))
 
     def load_showfile(self, name: str) -> None:
         nm = os.path.expanduser(name)
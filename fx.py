@@ -16,12 +16,22 @@
 # possibly existing python implemantation of perlin noise?
 # https://gitlab.com/atrus6/pynoise/-/tree/master/pynoise?ref_type=heads
 
+import ast
 import functools
 import itertools
 import math
-from typing import Any, List, Dict
-
-from registration import EFX, register_efx, EnabledEFX
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, List, Dict, Optional, Sequence, Tuple
+
+from geometry import Placement, nearest_pan_tilt
+from registration import (
+    EFX,
+    BackgroundEFX,
+    EnabledEFX,
+    SyncedEFX,
+    register_efx,
+)
 from trait import RGB, Channel, IntensityChannel, DegreesChannel, PTPos, IntChannel
 
 # Hash lookup table as defined by Ken Perlin.  This is a randomly
@@ -132,7 +142,7 @@ def lerp(a: float, b: float, x: float) -> float:
 
 
 @register_efx
-class PerlinNoiseEFX(EnabledEFX, EFX):
+class PerlinNoiseEFX(SyncedEFX, EnabledEFX, EFX):
     def __init__(self, count=0, trunc=math.sqrt(0.5)) -> None:
         self.speed = Channel()
         super().__init__()
@@ -150,12 +160,73 @@ class PerlinNoiseEFX(EnabledEFX, EFX):
         # *reduces* the effective scale, which doesn't seem right.
         # I've just mapped the coordinates as position, equivelent to scale=w or h
         # The output of perlin lies between -sqrt(0.5) and +sqrt(0.5)
-        z = counter * (self.speed.value.pos / 100.0)
+        z = self.timebase(counter) * (self.speed.value.pos / 100.0)
         if self.enabled.value.pos > 0:
             for i in range(self._count):
                 self._outputs[i].set(int(256 * perlin01(i, 1, z, trunc=self._trunc)))
 
 
+@register_efx
+class PerlinFieldEFX(SyncedEFX, EnabledEFX, BackgroundEFX):
+    # PerlinNoiseEFX over a width x height grid, outputs o0...oN row by row.
+    # Large grids take longer than a frame, so the field is computed off the
+    # tick by BackgroundEFX. The noise is pure Python, on a thread it would hold
+    # the GIL against the tick, so unless given an executor the fields share a
+    # process pool.
+    _process_pool: Optional[Executor] = None
+
+    def __init__(
+        self,
+        width=8,
+        height=8,
+        scale=4.0,
+        trunc=math.sqrt(0.5),
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.speed = Channel()
+        super().__init__()
+        self.executor = executor
+        self._width = width
+        self._height = height
+        self._scale = scale
+        self._trunc = trunc
+        self._outputs: List[Channel] = []
+        for i in range(width * height):
+            o = IntensityChannel()
+            self._outputs.append(o)
+            setattr(self, f"o{i}", o)
+
+    def _get_executor(self) -> Executor:
+        if self.executor is not None:
+            return self.executor
+        if PerlinFieldEFX._process_pool is None:
+            PerlinFieldEFX._process_pool = ProcessPoolExecutor()
+        return PerlinFieldEFX._process_pool
+
+    def tick(self, counter: float) -> None:
+        if self.enabled.value.pos > 0:
+            super().tick(counter)
+
+    def snapshot(self, counter: float) -> Any:
+        z = self.timebase(counter) * (self.speed.value.pos / 100.0)
+        return (self._width, self._height, self._scale, self._trunc, z)
+
+    @staticmethod
+    def compute(snapshot: Any) -> List[int]:
+        w, h, scale, trunc, z = snapshot
+        sx = scale / w
+        sy = scale / h
+        return [
+            int(255 * perlin01(x * sx, y * sy, z, trunc=trunc))
+            for y in range(h)
+            for x in range(w)
+        ]
+
+    def apply(self, result: List[int]) -> None:
+        for o, v in zip(self._outputs, result):
+            o.set(v)
+
+
 @register_efx
 class ColourInterpolateEFX(EnabledEFX, EFX):
     # Rainbow   0xFF0000, 0x00FF00, 0x0000FF
@@ -174,10 +245,12 @@ class ColourInterpolateEFX(EnabledEFX, EFX):
             self._control_points.append(c)
             c._patch_listener(self.remap_control)
 
+        self._outputs: List[RGB] = []
         for i in range(channels):
             inch = IntensityChannel()
             setattr(self, f"i{i}", inch)
             och = RGB()
+            self._outputs.append(och)
             setattr(self, f"o{i}", och)
             inch._patch_listener(functools.partial(self.remap_intensity, inch, och))
 
@@ -227,7 +300,7 @@ class StaticCopy(EnabledEFX, EFX):
 
 
 @register_efx
-class CosPulseEFX(EnabledEFX, EFX):
+class CosPulseEFX(SyncedEFX, EnabledEFX, EFX):
     def __init__(self, trait_type=IntensityChannel, channels=4) -> None:
         super().__init__()
         self.speed = Channel()
@@ -246,7 +319,7 @@ class CosPulseEFX(EnabledEFX, EFX):
 
     def tick(self, counter: float) -> None:
         if self.enabled.value.pos > 0:
-            pos = counter * ((self.speed.value.pos - 128) / 50.0)
+            pos = self.timebase(counter) * ((self.speed.value.pos - 128) / 50.0)
             pos = (pos % self.channels) * math.pi
             for i, o in enumerate(self._outputs):
                 t0 = pos - i * math.pi
@@ -258,7 +331,8 @@ class CosPulseEFX(EnabledEFX, EFX):
 @register_efx
 class ChangeInBlack(EFX):
     # monitor 'changes' list for changes, when they do, blackout the output
-    # channel for blackout seconds
+    # channel for blackout seconds. For fixture wheels prefer the
+    # stages.MoveInBlack output stage, which needs no wiring
     def __init__(
         self, channels=4, changes=[], blackout=0.3, trait_type=IntensityChannel
     ) -> None:
@@ -321,7 +395,12 @@ class ChangeInBlack(EFX):
 class PositionIndexer(EFX):
     # stores preset home positions for moving heads, indexed by 'preset'. Configure
     # by editing preset and c0...cN one at a time.
-    # inputs i0...iN are relative changes to the position
+    # inputs i0...iN are relative changes to the position, spread over width
+    # degrees along the direction angle (0 is pan only, 90 tilt only). The
+    # default 45 moves pan and tilt together by the full width, as the spread
+    # always did before it had an angle.
+    # Home positions are kept in flat arrays indexed [channel * presets + preset]
+    # and every output is recomputed in one pass.
     def __init__(self, channels=4, presets=2, is_global=True) -> None:
         super().__init__()
         self._outputs: List[PTPos] = []
@@ -334,13 +413,12 @@ class PositionIndexer(EFX):
 
         self.width = DegreesChannel()
         self.width._patch_listener(self.on_width_change)
+        self.angle = DegreesChannel(value=45)
+        self.angle._patch_listener(self.on_width_change)
 
-        self.data: List[List[PTPos]] = []
-        for i in range(channels):
-            ch_fg = []
-            for j in range(presets):
-                ch_fg.append(PTPos())
-            self.data.append(ch_fg)
+        self._pan = array("i", bytes(4 * channels * presets))
+        self._tilt = array("i", bytes(4 * channels * presets))
+        self._switching = False
 
         for i in range(channels):
             inch = Channel()
@@ -364,36 +442,59 @@ class PositionIndexer(EFX):
         self.switch_preset(p)
 
     def switch_preset(self, p: int) -> None:
-        for ch in range(len(self._inputs)):
-            self.data[ch][p]._copy_to(self.controlpts[ch], src=self)
-            self.recalculate_ch(ch)
+        n = self._presets
+        self._switching = True
+        for ch, control in enumerate(self.controlpts):
+            control.set_pos(self._pan[ch * n + p], self._tilt[ch * n + p])
+        self._switching = False
+        self.recalculate()
 
     def on_width_change(self, src: Any):
-        for i in range(len(self._inputs)):
-            self.recalculate_ch(i)
+        self.recalculate()
 
     def on_input_change(self, i, src: Any) -> None:
-        self.recalculate_ch(i)
+        self.recalculate([i])
 
     def on_control_change(self, ch, control, src: Any) -> None:
-        if src == self:
+        if self._switching:
             return
+        k = ch * self._presets + self.preset.value.pos
+        self._pan[k] = control.pan.pos
+        self._tilt[k] = control.tilt.pos
+        self.recalculate([ch])
+
+    def recalculate(self, chs: Optional[Sequence[int]] = None) -> None:
+        if chs is None:
+            chs = range(self._channels)
+        n = self._presets
         p = self.preset.value.pos
-        control._copy_to(self.data[ch][p], src=self)
-        self.recalculate_ch(ch)
-
-    def recalculate_ch(self, ch: int) -> None:
-        p = self.preset.value.pos
-        control = self.data[ch][p]
-        inp = self._inputs[ch]
         width = self.width.value.pos  # width in degrees
+        angle = math.radians(self.angle.value.pos)
+        # scaled so the larger of the two moves by the whole width
+        cos_a = math.cos(angle)
+        sin_a = math.sin(angle)
+        longest = max(abs(cos_a), abs(sin_a))
+        cos_a /= longest
+        sin_a /= longest
+        changed = []
+        for ch in chs:
+            out = self._outputs[ch]
+            delta_degrees = self._inputs[ch].as_fraction() * width - (width / 2)
+            pan = self._pan[ch * n + p] + (
+                delta_degrees * cos_a * out.pan.pos_max / out.pan_range
+            )
+            tilt = self._tilt[ch * n + p] + (
+                delta_degrees * sin_a * out.tilt.pos_max / out.tilt_range
+            )
+            c = out.pan.set(pan)
+            if out.tilt.set(tilt) or c:
+                changed.append(out)
+        # outputs are bound to heads, notify once each after all are set
+        for out in changed:
+            out._changed(None)
 
-        delta_degrees = inp.as_fraction() * width - (width / 2)
-        # decompose delta_degrees based on self.angle
-        pan = delta_degrees
-        tilt = delta_degrees
-        out = self._outputs[ch]
-        out.set_degrees_relative_to(control, pan, tilt)
+    def recalculate_ch(self, ch: int) -> None:
+        self.recalculate([ch])
 
     def set_global(self, state: Dict[str, Any]) -> None:
         # push our internal position data into global config
@@ -404,7 +505,8 @@ class PositionIndexer(EFX):
                 k = f"data-{i}-{j}"
                 tr = state.get(k)
                 if tr:
-                    self.data[i][j].set_global(tr)
+                    self._pan[i * self._presets + j] = tr.get("pan", 0)
+                    self._tilt[i * self._presets + j] = tr.get("tilt", 0)
         self.switch_preset(0)
 
     def get_global_as_dict(self):
@@ -412,8 +514,232 @@ class PositionIndexer(EFX):
         for i in range(self._channels):
             for j in range(self._presets):
                 k = f"data-{i}-{j}"
-                d[k] = self.data[i][j].get_state_as_dict()
+                d[k] = {
+                    "pan": self._pan[i * self._presets + j],
+                    "tilt": self._tilt[i * self._presets + j],
+                }
+
+        return d
+
 
+@register_efx
+class TrackingEFX(EnabledEFX, EFX):
+    # points all outputs at a single target. Target x, y, z are in centimetres of
+    # stage coordinates, each output o0...oN needs the Placement of the head it
+    # is bound to. Placements are flattened once so only the target changes per
+    # frame. Channels cannot go negative, so each holds its coordinate plus
+    # size / 2, covering size centimetres centred on the stage origin, and
+    # starts at the origin.
+    def __init__(
+        self,
+        placements: Sequence[Placement] = [],
+        pan_range=540,
+        tilt_range=180,
+        size=2000,
+    ) -> None:
+        super().__init__()
+        self._origin = size // 2
+        self.x = Channel(value=self._origin, pos_max=size)
+        self.y = Channel(value=self._origin, pos_max=size)
+        self.z = Channel(value=self._origin, pos_max=size)
+        self._pan_range = pan_range
+        self._tilt_range = tilt_range
+        self._transforms: List[Tuple[float, ...]] = []
+        self._last_pan: List[float] = []
+        self._outputs: List[PTPos] = []
+        for i, placement in enumerate(placements):
+            self._transforms.append(placement.transform())
+            self._last_pan.append(0)
+            och = PTPos(pan_range=pan_range, tilt_range=tilt_range)
+            self._outputs.append(och)
+            setattr(self, f"o{i}", och)
+
+        self._dirty = True
+        for t in [self.x, self.y, self.z, self.enabled]:
+            t._patch_listener(self.on_target_change)
+
+    def set_placement(self, i: int, placement: Placement) -> None:
+        self._transforms[i] = placement.transform()
+        self._dirty = True
+
+    def set_target(self, x: float, y: float, z: float) -> None:
+        # target in metres from the stage origin
+        self.x.set(round(x * 100) + self._origin)
+        self.y.set(round(y * 100) + self._origin)
+        self.z.set(round(z * 100) + self._origin)
+
+    def on_target_change(self, src: Any) -> None:
+        self._dirty = True
+
+    def tick(self, counter: float) -> None:
+        if self.enabled.value.pos > 0 and self._dirty:
+            self._dirty = False
+            x = (self.x.value.pos - self._origin) / 100
+            y = (self.y.value.pos - self._origin) / 100
+            z = (self.z.value.pos - self._origin) / 100
+            for o, (pan, tilt) in zip(self._outputs, self.solve(x, y, z)):
+                o.set_degrees_pos(pan, tilt)
+
+    def solve(self, x: float, y: float, z: float) -> List[Tuple[float, float]]:
+        result = []
+        for i, (px, py, pz, a, b, c, d, e, f, g, h, k) in enumerate(self._transforms):
+            dx, dy, dz = x - px, y - py, z - pz
+            lx = a * dx + b * dy + c * dz
+            ly = d * dx + e * dy + f * dz
+            lz = g * dx + h * dy + k * dz
+            radial = math.hypot(lx, ly)
+            # directly beneath the head any pan will do, so keep the last one
+            pan = math.degrees(math.atan2(ly, lx)) if radial else self._last_pan[i]
+            tilt = math.degrees(math.atan2(radial, -lz))
+            pan, tilt = nearest_pan_tilt(
+                pan, tilt, self._last_pan[i], self._pan_range, self._tilt_range
+            )
+            self._last_pan[i] = pan
+            result.append((pan, tilt))
+        return result
+
+
+_expression_functions: Dict[str, Any] = {
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "pi": math.pi,
+    "perlin": perlin01,
+    "clamp": lambda v, lo=0.0, hi=1.0: max(lo, min(hi, v)),
+    **{
+        k: getattr(math, k)
+        for k in ["sin", "cos", "tan", "sqrt", "exp", "log", "floor", "fmod", "hypot"]
+    },
+}
+_expression_names = {"t", "i", "n", "x", "y", "z", "a", "b"}
+_expression_nodes = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.unaryop,
+    ast.boolop,
+    ast.cmpop,
+)
+
+
+def compile_expression(expression: str) -> Callable[..., List[float]]:
+    # returns f(t, a, b, n, points) evaluating expression once for each
+    # (i, x, y, z) in points, as a single list comprehension
+    tree = ast.parse(expression, mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _expression_nodes):
+            raise ValueError(f"{type(node).__name__} not allowed in expression")
+        if isinstance(node, ast.Name):
+            if (
+                node.id not in _expression_names
+                and node.id not in _expression_functions
+            ):
+                raise ValueError(f"Unknown name {node.id}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError("Only numbers allowed in expression")
+        if isinstance(node, ast.Call) and (
+            not isinstance(node.func, ast.Name) or node.keywords
+        ):
+            raise ValueError("Only simple function calls allowed in expression")
+    source = f"lambda t, a, b, n, points: [({expression}) for i, x, y, z in points]"
+    code = compile(_FloatPow().visit(ast.parse(source, mode="eval")), "<expr>", "eval")
+    return eval(code, {"__builtins__": {}, "__pow": math.pow, **_expression_functions})
+
+
+class _FloatPow(ast.NodeTransformer):
+    # a ** b becomes math.pow(a, b), so 9 ** 9 ** 9 overflows straight away
+    # rather than working out a huge int
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Pow):
+            return node
+        call = ast.Call(
+            func=ast.Name(id="__pow", ctx=ast.Load()),
+            args=[node.left, node.right],
+            keywords=[],
+        )
+        return ast.fix_missing_locations(ast.copy_location(call, node))
+
+
+@register_efx
+class ExpressionEFX(SyncedEFX, EnabledEFX, EFX):
+    # outputs o0...oN are a user expression in
+    #   t     showtime in seconds (or beats when synced)
+    #   i, n  output index and number of outputs
+    #   x,y,z placement of the output's fixture in metres, or i,0,0 if not given
+    #   a, b  inputs, 0-1
+    # giving 0-1 for black to full, eg. "sin(t * 2 + i * 0.3) / 2 + 0.5"
+    def __init__(
+        self,
+        expression: str = "0",
+        channels=4,
+        placements: Optional[Sequence[Placement]] = None,
+    ) -> None:
+        super().__init__()
+        self.a = Channel()
+        self.b = Channel()
+        self._outputs: List[Channel] = []
+        for i in range(channels):
+            och = IntensityChannel()
+            self._outputs.append(och)
+            setattr(self, f"o{i}", och)
+        self._points: List[Tuple[int, float, float, float]]
+        if placements is None:
+            self._points = [(i, float(i), 0.0, 0.0) for i in range(channels)]
+        else:
+            self._points = [(i, *p.position) for i, p in enumerate(placements)]
+        self.set_expression(expression)
+
+    def set_expression(self, expression: str) -> None:
+        # raises ValueError or SyntaxError, or TypeError for a bad function call,
+        # leaving the previous expression running. Maths errors on the trial run
+        # are fine, eg. log(t) or 1 / t at t = 0, tick skips those frames
+        fn = compile_expression(expression)
+        try:
+            fn(0.0, 0.0, 0.0, len(self._points), self._points)
+        except (ArithmeticError, ValueError):
+            pass
+        self._fn = fn
+        self.expression = expression
+
+    def tick(self, counter: float) -> None:
+        if self.enabled.value.pos > 0:
+            try:
+                values = self._fn(
+                    self.timebase(counter),
+                    self.a.as_fraction(),
+                    self.b.as_fraction(),
+                    len(self._points),
+                    self._points,
+                )
+            except (ArithmeticError, ValueError):
+                return
+            for o, v in zip(self._outputs, values):
+                o.set(int(255 * max(0, min(1, v))))
+
+    def set_global(self, state: Dict[str, Any]) -> None:
+        super().set_global(state)
+        expression = state.get("expression")
+        if expression:
+            self.set_expression(expression)
+
+    def get_global_as_dict(self):
+        d = super().get_global_as_dict()
+        d["expression"] = self.expression
         return d
 
 
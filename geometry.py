@@ -0,0 +1,91 @@
+import math
+from typing import List, Tuple
+
+# Stage coordinates are in metres: x towards stage right, y upstage, z up. The
+# origin is wherever the rig is measured from, eg. centre stage at floor level,
+# so anything stage left of it, downstage or below has negative coordinates.
+#
+# A moving head at pan=0, tilt=0 points straight down its own -z axis (ie. a
+# head hung from a truss), tilting towards its own +x axis and panning about its
+# own z axis. Floor standing heads are described with roll=180.
+
+Vector = Tuple[float, float, float]
+
+
+class Placement:
+    def __init__(
+        self,
+        x: float = 0,
+        y: float = 0,
+        z: float = 0,
+        yaw: float = 0,
+        pitch: float = 0,
+        roll: float = 0,
+    ) -> None:
+        self.position: Vector = (x, y, z)
+        self.yaw = yaw
+        self.pitch = pitch
+        self.roll = roll
+        self._world_to_local = self._rotation_transposed()
+
+    def _rotation_transposed(self) -> List[Vector]:
+        # local->world rotation is Rz(yaw).Ry(pitch).Rx(roll), we keep the rows
+        # of the transpose so that world vectors map to the head's frame.
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        cp, sp = math.cos(math.radians(self.pitch)), math.sin(math.radians(self.pitch))
+        cr, sr = math.cos(math.radians(self.roll)), math.sin(math.radians(self.roll))
+        return [
+            (cy * cp, sy * cp, -sp),
+            (cy * sp * sr - sy * cr, sy * sp * sr + cy * cr, cp * sr),
+            (cy * sp * cr + sy * sr, sy * sp * cr - cy * sr, cp * cr),
+        ]
+
+    def to_local(self, x: float, y: float, z: float) -> Vector:
+        px, py, pz = self.position
+        dx, dy, dz = x - px, y - py, z - pz
+        r0, r1, r2 = self._world_to_local
+        return (
+            r0[0] * dx + r0[1] * dy + r0[2] * dz,
+            r1[0] * dx + r1[1] * dy + r1[2] * dz,
+            r2[0] * dx + r2[1] * dy + r2[2] * dz,
+        )
+
+    def transform(self) -> Tuple[float, ...]:
+        # flattened (position, world->local rows) for use in tight loops
+        px, py, pz = self.position
+        r0, r1, r2 = self._world_to_local
+        return (px, py, pz, *r0, *r1, *r2)
+
+    def __repr__(self):
+        x, y, z = self.position
+        return f"Placement({x}, {y}, {z}, yaw={self.yaw}, pitch={self.pitch}, roll={self.roll})"
+
+
+def nearest_pan_tilt(
+    pan: float, tilt: float, last_pan: float, pan_range: float, tilt_range: float
+) -> Tuple[float, float]:
+    # (pan, tilt) and (pan + 180, -tilt) point the same way, and any pan can be
+    # offset by whole turns. Choose the reachable candidate closest to last_pan
+    # so that heads with more than 360 degrees of pan do not swing the long way.
+    half_pan = pan_range / 2
+    half_tilt = tilt_range / 2
+    best = (pan, tilt)
+    best_cost = math.inf
+    for p, t in ((pan, tilt), (pan + 180, -tilt)):
+        if abs(t) > half_tilt:
+            continue
+        p = math.fmod(p, 360)
+        for k in (-2, -1, 0, 1, 2):
+            c = p + 360 * k
+            if -half_pan <= c <= half_pan:
+                cost = abs(c - last_pan)
+                if cost < best_cost:
+                    best, best_cost = (c, t), cost
+    if best_cost == math.inf:
+        # target outside the reachable range, get as close as possible
+        if abs(tilt) > half_tilt:
+            return nearest_pan_tilt(
+                pan, math.copysign(half_tilt, tilt), last_pan, pan_range, tilt_range
+            )
+        return max(-half_pan, min(half_pan, math.fmod(pan, 360))), tilt
+    return best
@@ -0,0 +1,93 @@
+from typing import List, Tuple
+
+from channel import ChannelProp
+from trait import Trait
+
+# When several EFX drive one trait the last _copy_to wins. Instead each EFX can
+# be bound to its own layer of a LayerStack, and the controller composites the
+# layers onto the real trait once per frame, after EFX and before DMX is sent.
+#
+#   stack = controller.add_layer_stack(fixture.wash)
+#   static.c0.bind(stack.add_layer(priority=0).trait)
+#   col.o0.bind(stack.add_layer(priority=1, mode="add", opacity=0.5).trait)
+
+BLEND_MODES = ["replace", "add", "multiply", "max"]
+
+
+class Layer:
+    def __init__(
+        self,
+        stack: "LayerStack",
+        trait: Trait,
+        priority: int,
+        opacity: float,
+        mode: str,
+    ) -> None:
+        if mode not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode {mode}")
+        self.stack = stack
+        self.trait = trait
+        self.priority = priority
+        self.opacity = opacity
+        self.mode = mode
+        self.enabled = True
+        # (position in the target's channel list, layer channel)
+        names = dict(trait.channel_items())
+        self.channels: List[Tuple[int, ChannelProp]] = [
+            (k, names[name])
+            for k, (name, _) in enumerate(stack.channels)
+            if name in names
+        ]
+
+    def set_priority(self, priority: int) -> None:
+        self.priority = priority
+        self.stack._sort()
+
+
+class LayerStack:
+    def __init__(self, target: Trait) -> None:
+        self.target = target
+        # driven by the compositor, so like a bound trait it is not saved
+        target.is_bound = True
+        self.channels: List[Tuple[str, ChannelProp]] = list(target.channel_items())
+        self.layers: List[Layer] = []
+
+    def add_layer(self, priority=0, opacity=1.0, mode="replace") -> Layer:
+        layer = Layer(self, self.target.duplicate(), priority, opacity, mode)
+        self.layers.append(layer)
+        self._sort()
+        return layer
+
+    def remove_layer(self, layer: Layer) -> None:
+        self.layers.remove(layer)
+
+    def _sort(self) -> None:
+        # stable, so equal priorities composite in the order they were added
+        self.layers.sort(key=lambda layer: layer.priority)
+
+    def composite(self) -> bool:
+        out = [0.0] * len(self.channels)
+        for layer in self.layers:
+            if not layer.enabled:
+                continue
+            op = layer.opacity
+            mode = layer.mode
+            if mode == "replace":
+                for k, prop in layer.channels:
+                    out[k] += (prop.pos - out[k]) * op
+            elif mode == "add":
+                for k, prop in layer.channels:
+                    out[k] += prop.pos * op
+            elif mode == "multiply":
+                for k, prop in layer.channels:
+                    out[k] *= 1 - op + op * prop.pos / prop.pos_max
+            else:
+                for k, prop in layer.channels:
+                    out[k] = max(out[k], prop.pos * op)
+
+        changed = False
+        for (_, prop), v in zip(self.channels, out):
+            changed |= prop.set(int(v + 0.5))
+        if changed:
+            self.target._changed(None)
+        return changed
@@ -0,0 +1,188 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from channel import ChannelProp
+from registration import Pollable
+from tempo import TempoClock
+from trait import Trait
+
+# A modulation matrix moves EFX parameters (speed, width...) from LFOs and
+# envelopes. Every source is evaluated once per frame into a flat list, then the
+# routes are summed onto each destination's base value and written straight to
+# the ChannelProps. Going through Trait.set would fire the trait listeners for
+# every route on every frame; EFX read their parameters on tick anyway, so only
+# routes asked to notify call the listeners, once per trait.
+#
+#   matrix = ModulationMatrix(controller.tempo)
+#   lfo = matrix.add_source(LFO(beats=4))
+#   matrix.route(lfo, perlin.speed, depth=0.25)
+#   controller.add_pollable(matrix)  # pollables tick before EFX
+
+
+class ModSource(ABC):
+    @abstractmethod
+    def value(self, showtime: float, beats: float) -> float:
+        pass
+
+
+LFO_SHAPES = ["sine", "triangle", "square", "saw"]
+
+
+class LFO(ModSource):
+    # bipolar, -1 to 1. Runs at rate Hz, or if beats is set one cycle takes that
+    # many beats of the tempo clock
+    def __init__(
+        self, rate=1.0, shape="sine", phase=0.0, beats: Optional[float] = None
+    ) -> None:
+        if shape not in LFO_SHAPES:
+            raise ValueError(f"Unknown LFO shape {shape}")
+        self.rate = rate
+        self.shape = shape
+        self.phase = phase
+        self.beats = beats
+
+    def value(self, showtime: float, beats: float) -> float:
+        if self.beats is not None:
+            cycles = beats / self.beats
+        else:
+            cycles = showtime * self.rate
+        p = (cycles + self.phase) % 1
+        if self.shape == "sine":
+            return math.sin(2 * math.pi * p)
+        elif self.shape == "triangle":
+            return 1 - 4 * abs(p - 0.5)
+        elif self.shape == "square":
+            return 1.0 if p < 0.5 else -1.0
+        return 2 * p - 1
+
+
+class Envelope(ModSource):
+    # unipolar ADSR, 0 to 1. trigger() starts the attack, release() the release
+    def __init__(self, attack=0.1, decay=0.2, sustain=0.7, release=0.5) -> None:
+        self.attack = attack
+        self.decay = decay
+        self.sustain = sustain
+        self.release_time = release
+        self._on: Optional[float] = None
+        self._off: Optional[float] = None
+        self._pending: Optional[str] = None
+        self._off_level = 0.0
+
+    def trigger(self) -> None:
+        # takes effect on the next frame, so it can be called from a listener
+        self._pending = "on"
+
+    def release(self) -> None:
+        self._pending = "off"
+
+    def _held(self, t: float) -> float:
+        if t < self.attack:
+            return t / self.attack
+        t -= self.attack
+        if t < self.decay:
+            return 1 - (1 - self.sustain) * t / self.decay
+        return self.sustain
+
+    def value(self, showtime: float, beats: float) -> float:
+        if self._pending == "on":
+            self._on, self._off = showtime, None
+        elif self._pending == "off" and self._on is not None and self._off is None:
+            self._off_level = self._held(showtime - self._on)
+            self._off = showtime
+        self._pending = None
+
+        if self._on is None:
+            return 0.0
+        if self._off is None:
+            return self._held(showtime - self._on)
+        t = showtime - self._off
+        if t >= self.release_time:
+            return 0.0
+        return self._off_level * (1 - t / self.release_time)
+
+
+class ModulationMatrix(Pollable):
+    def __init__(self, tempo: Optional[TempoClock] = None) -> None:
+        self.tempo = tempo
+        self.sources: List[ModSource] = []
+        # per destination channel
+        self._props: List[ChannelProp] = []
+        self._base: List[float] = []
+        self._dest: Dict[ChannelProp, int] = {}
+        # per route, parallel lists of source, destination and depth in steps
+        self._route_src: List[int] = []
+        self._route_dest: List[int] = []
+        self._route_depth: List[float] = []
+        # traits to notify after writing, each once
+        self._notify: Dict[Trait, List[int]] = {}
+
+    def add_source(self, source: ModSource) -> ModSource:
+        self.sources.append(source)
+        return source
+
+    def route(
+        self,
+        source: ModSource,
+        trait: Trait,
+        depth: float,
+        channel: Optional[str] = None,
+        notify=False,
+    ) -> int:
+        # depth is a fraction of the channel's range, so an LFO at depth 0.25
+        # swings a quarter of the range either side of the base value. Set
+        # notify for traits whose listeners must see the change (eg.
+        # PositionIndexer.width recomputes on change)
+        if source not in self.sources:
+            self.add_source(source)
+        channels = dict(trait.channel_items())
+        if channel is None:
+            if len(channels) != 1:
+                raise ValueError(f"{trait} has several channels, name one")
+            channel = next(iter(channels))
+        prop = channels[channel]
+
+        d = self._dest.get(prop)
+        if d is None:
+            d = len(self._props)
+            self._dest[prop] = d
+            self._props.append(prop)
+            self._base.append(prop.pos)
+        if notify:
+            self._notify.setdefault(trait, []).append(d)
+
+        self._route_src.append(self.sources.index(source))
+        self._route_dest.append(d)
+        self._route_depth.append(depth * (prop.pos_max - prop.pos_min))
+        return len(self._route_src) - 1
+
+    def set_depth(self, route: int, depth: float) -> None:
+        prop = self._props[self._route_dest[route]]
+        self._route_depth[route] = depth * (prop.pos_max - prop.pos_min)
+
+    def tick(self, showtime: float) -> None:
+        beats = self.tempo.beats if self.tempo else 0.0
+        values = [s.value(showtime, beats) for s in self.sources]
+
+        props = self._props
+        base = self._base
+        # anything else that set a destination since the last frame (MIDI, the
+        # UI, a preset), even to the value already there, sets a new base for
+        # the modulation to swing around
+        for d, prop in enumerate(props):
+            if prop.source is not self:
+                base[d] = prop.pos
+
+        out = list(base)
+        for s, d, depth in zip(self._route_src, self._route_dest, self._route_depth):
+            out[d] += values[s] * depth
+
+        changed = [False] * len(props)
+        for d, (prop, v) in enumerate(zip(props, out)):
+            changed[d] = prop.set(int(v + 0.5), source=self)
+            # presets save the base rather than wherever the swing has got to
+            prop.held = int(base[d])
+
+        for trait, dests in self._notify.items():
+            if any(changed[d] for d in dests):
+                trait._changed(None)
@@ -0,0 +1,255 @@
+# A local stand-in for olad, enough of its RPC port for OlaClient: DMX in with
+# UpdateDmxData and StreamDmxData, GetDmx, GetUniverseInfo, GetPlugins and
+# GetDeviceInfo, and RegisterForDmx with push_dmx playing the part of an input
+# port.
+# Replies can be held back by ack_delay plus up to jitter seconds, and every
+# frame's arrival time is recorded per universe, so tests and benchmarks can run
+# without a real olad.
+#
+#   python olad_standin.py --port 9010 --ack-delay 0.002 --jitter 0.005
+
+import argparse
+import asyncio
+import random
+import struct
+import time
+from typing import Callable, Optional
+
+import betterproto
+
+from ola.proto import (
+    Ack,
+    DeviceInfo,
+    DeviceInfoReply,
+    DeviceInfoRequest,
+    DmxData,
+    MergeMode,
+    OptionalUniverseRequest,
+    PluginInfo,
+    PluginListReply,
+    PluginListRequest,
+    RegisterAction,
+    RegisterDmxRequest,
+    UniverseInfo,
+    UniverseInfoReply,
+    UniverseRequest,
+)
+from ola.rpc import RpcMessage, Type
+
+
+class RpcFailed(Exception):
+    # raised by a handler to answer RESPONSE_FAILED with the reason, as olad
+    # does
+    pass
+
+
+class OladStandin:
+    # tag keeps that many leading bytes of every frame with its arrival time, so
+    # a benchmark can stamp frames and match them up with the tick sending them.
+    # Arrival times are time.monotonic(), which is system wide, so they compare
+    # with a client in another process.
+    def __init__(self, ack_delay=0.0, jitter=0.0, tag=0) -> None:
+        self.ack_delay = ack_delay
+        self.jitter = jitter
+        self.tag = tag
+        # universe -> latest data, and [(arrival, tag bytes)] of every frame
+        self.dmx: dict[int, bytes] = {}
+        self.arrivals: dict[int, list[tuple[float, bytes]]] = {}
+        self.plugins = [PluginInfo(plugin_id=1, name="Dummy", active=True)]
+        self.devices: list[DeviceInfo] = []
+        # methods never replied to, for testing timeouts, and methods failed
+        self.hold: set[str] = set()
+        self.fail: set[str] = set()
+        self.requests = 0
+        # replies from clients to pushed input
+        self.acks = 0
+        self._registered: dict[int, set[asyncio.StreamWriter]] = {}
+        self._push_id = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._methods: dict[
+            str,
+            tuple[type[betterproto.Message], Callable[..., betterproto.Message]],
+        ] = {
+            "UpdateDmxData": (DmxData, self._update_dmx),
+            "StreamDmxData": (DmxData, self._update_dmx),
+            "GetDmx": (UniverseRequest, self._get_dmx),
+            "GetUniverseInfo": (OptionalUniverseRequest, self._get_universe_info),
+            "GetPlugins": (PluginListRequest, self._get_plugins),
+            "GetDeviceInfo": (DeviceInfoRequest, self._get_device_info),
+            "RegisterForDmx": (RegisterDmxRequest, self._register_for_dmx),
+        }
+
+    async def start(self, host="127.0.0.1", port=0) -> int:
+        # returns the port, port 0 picks a free one
+        self._server = await asyncio.start_server(self._client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        # closing the sockets ends each client's reader loop
+        writers = list(self._writers)
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(
+            *(w.wait_closed() for w in writers), return_exceptions=True
+        )
+
+    def reset(self) -> None:
+        self.arrivals = {}
+        self.requests = 0
+
+    async def _client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                (h,) = struct.unpack("<L", await reader.readexactly(4))
+                body = await reader.readexactly(h & 0x0FFFFFF)
+                arrived = time.monotonic()
+                reply = self._dispatch(RpcMessage().parse(body), arrived, writer)
+                if reply is None:
+                    continue
+                delay = self.ack_delay + random.uniform(0, self.jitter)
+                if delay > 0:
+                    # may overtake each other, as a busy olad's replies can
+                    loop.call_later(delay, self._send, writer, reply)
+                else:
+                    self._send(writer, reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            for clients in self._registered.values():
+                clients.discard(writer)
+            writer.close()
+
+    def _send(self, writer: asyncio.StreamWriter, reply: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(struct.pack("<L", (1 << 28) | len(reply)) + reply)
+
+    def push_dmx(self, universe: int, data: bytes) -> int:
+        # sends input to every client registered for universe, as olad does
+        # when an input port receives a frame. Returns how many it went to
+        clients = self._registered.get(universe, set())
+        for writer in clients:
+            self._push_id += 1
+            message = RpcMessage(
+                type=Type.REQUEST,
+                id=self._push_id,
+                name="UpdateDmxData",
+                buffer=bytes(DmxData(universe=universe, data=data)),
+            )
+            self._send(writer, bytes(message))
+        return len(clients)
+
+    def _dispatch(
+        self, m: RpcMessage, arrived: float, writer: asyncio.StreamWriter
+    ) -> Optional[bytes]:
+        method = self._methods.get(m.name)
+        if m.type == Type.REQUEST:
+            self.requests += 1
+        elif m.type == Type.RESPONSE:
+            self.acks += 1
+            return None
+        elif m.type != Type.STREAM_REQUEST:
+            return None
+        if method is None:
+            result = RpcMessage(
+                type=Type.RESPONSE_NOT_IMPLEMENTED,
+                id=m.id,
+                buffer=f"Unknown method {m.name}".encode(),
+            )
+        else:
+            request_cls, handle = method
+            try:
+                if m.name in self.fail:
+                    raise RpcFailed(f"{m.name} failed")
+                response = handle(request_cls().parse(m.buffer), arrived, writer)
+                result = RpcMessage(type=Type.RESPONSE, id=m.id, buffer=bytes(response))
+            except RpcFailed as e:
+                result = RpcMessage(
+                    type=Type.RESPONSE_FAILED, id=m.id, buffer=str(e).encode()
+                )
+        if m.type == Type.STREAM_REQUEST or m.name in self.hold:
+            return None
+        return bytes(result)
+
+    def _update_dmx(self, request: DmxData, arrived: float, writer) -> Ack:
+        self.dmx[request.universe] = request.data
+        self.arrivals.setdefault(request.universe, []).append(
+            (arrived, request.data[: self.tag])
+        )
+        return Ack()
+
+    def _get_dmx(self, request: UniverseRequest, arrived: float, writer) -> DmxData:
+        if request.universe not in self.dmx:
+            raise RpcFailed("Universe doesn't exist")
+        return DmxData(universe=request.universe, data=self.dmx[request.universe])
+
+    def _get_universe_info(
+        self, request: OptionalUniverseRequest, arrived: float, writer
+    ) -> UniverseInfoReply:
+        # every universe that has been sent a frame. proto3 cannot tell universe
+        # 0 from unset, so 0 asks for all of them
+        universes = sorted(self.dmx)
+        if request.universe:
+            universes = [u for u in universes if u == request.universe]
+        return UniverseInfoReply(
+            universe=[
+                UniverseInfo(universe=u, name=f"Universe {u}", merge_mode=MergeMode.HTP)
+                for u in universes
+            ]
+        )
+
+    def _get_plugins(
+        self, request: PluginListRequest, arrived: float, writer
+    ) -> PluginListReply:
+        return PluginListReply(plugin=self.plugins)
+
+    def _get_device_info(
+        self, request: DeviceInfoRequest, arrived: float, writer
+    ) -> DeviceInfoReply:
+        return DeviceInfoReply(
+            device=[
+                d
+                for d in self.devices
+                if not request.plugin_id or d.plugin_id == request.plugin_id
+            ]
+        )
+
+    def _register_for_dmx(
+        self, request: RegisterDmxRequest, arrived: float, writer
+    ) -> Ack:
+        clients = self._registered.setdefault(request.universe, set())
+        if request.action == RegisterAction.UNREGISTER:
+            clients.discard(writer)
+        else:
+            clients.add(writer)
+        return Ack()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Stand-in for olad's RPC port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9010)
+    parser.add_argument("--ack-delay", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    args = parser.parse_args()
+
+    olad = OladStandin(ack_delay=args.ack_delay, jitter=args.jitter)
+    port = await olad.start(args.host, args.port)
+    print(f"olad stand-in listening on {args.host}:{port}")
+    while True:
+        await asyncio.sleep(10)
+        frames = sum(len(a) for a in olad.arrivals.values())
+        print(f"{len(olad.dmx)} universes, {frames} frames, {olad.requests} requests")
+        olad.reset()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
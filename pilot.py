@@ -8,6 +8,7 @@ from typing import (
     Dict,
     Generic,
     List,
+    Tuple,
     TypeVar,
     Optional,
 )
@@ -36,6 +37,7 @@ from textual.widgets._data_table import RowKey
 
 from channel import ChannelProp
 from desk import EFX, Fixture, MidiCC, build_show, NetNode, Controller
+from fx import ExpressionEFX
 from registration import fixture_class_list, ThingWithTraits
 from trait import (
     RGB,
@@ -86,7 +88,8 @@ class ShowtimeDisplay(NoReLayoutStatic):
         hours, minutes = divmod(minutes, 60)
         self.update(
             f"Showtime {hours:02,.0f}:{minutes:02.0f}:{seconds:05.2f} fps "
-            + f"{self.controller.fps:02.0f}/{self.controller.target_fps:02.0f}  {BLACKOUT_DICT[self.controller.blackout]}"
+            + f"{self.controller.fps:02.0f}/{self.controller.target_fps:02.0f} bpm "
+            + f"{self.controller.tempo.get_bpm():3.0f}  {BLACKOUT_DICT[self.controller.blackout]}"
         )
 
 
@@ -96,8 +99,13 @@ class NodeTable(DataTable):
         self.controller_nodes = controller.nodes
         self.node_keys: dict[NetNode, RowKey] = {}
 
+    def _row(self, node) -> Tuple[str, str, Any, str]:
+        # art-net nodes have a longName, other outputs just a name
+        name = getattr(node, "longName", None) or node.name
+        return (node.address, name, node.ports, getattr(node, "state", ""))
+
     def _do_add_row(self, node):
-        self.node_keys[node] = self.add_row(node.address, node.longName, node.ports)
+        self.node_keys[node] = self.add_row(*self._row(node))
 
     def on_mount(self) -> None:
         # iterate fixtures for traits, build dicts
@@ -106,6 +114,7 @@ class NodeTable(DataTable):
         self.add_column("address", key="address")
         self.add_column("name", key="name")
         self.add_column("ports", key="ports")
+        self.add_column("state", key="state")
 
         for node in self.controller_nodes.keys():
             self._do_add_row(node)
@@ -113,20 +122,25 @@ class NodeTable(DataTable):
 
         self.controller_nodes.added.sub(self._do_add_row)
         self.controller_nodes.changed.sub(self.on_node_changed)
+        self.controller_nodes.removed.sub(self.on_node_removed)
 
     def on_node_changed(
         self,
         node: NetNode,
     ) -> None:
-        # if node not in self.nodes:
-        #    rk = self.add_row(node.address, node.name)
-        #    self.nodes[node] = rk
-        # for t in ['address', 'name']:
-        #    attr = str(getattr(node, t))
-        #    rk2 = self.nodes[node]
-        #    if rk2:
-        #        self.update_cell(rk2, t, attr)
-        pass
+        rk = self.node_keys.get(node)
+        if rk is None:
+            self._do_add_row(node)
+            return
+        for column, value in zip(
+            ["address", "name", "ports", "state"], self._row(node)
+        ):
+            self.update_cell(rk, column, value)
+
+    def on_node_removed(self, node: NetNode) -> None:
+        rk = self.node_keys.pop(node, None)
+        if rk is not None:
+            self.remove_row(rk)
 
 
 class UniverseDisplay(NoReLayoutStatic):
@@ -268,6 +282,15 @@ class EFXTable(TraitTable[EFX]):
     def __init__(self, efx):
         super().__init__(efx, ["name"])
 
+    def action_add_efx(self) -> None:
+        def add_efx_cb(efx: Optional[ExpressionEFX]):
+            if efx is not None:
+                efx.enabled.set(1)
+                self.app.controller.add_efx(efx)  # type: ignore[attr-defined]
+                self.rk[efx] = self.add_row(*self._get_row_data(efx))
+
+        self.app.push_screen(AddExpressionScreen(), add_efx_cb)
+
 
 def fmt_colour(rgb: RGB) -> Text:
     # t = f"⬤ {rgb.red.pos:3} {rgb.green.pos:3} {rgb.blue.pos:3}"
@@ -285,7 +308,7 @@ def fmt_pos(pos: PTPos) -> Text:
 
 
 def fmt_ch(channel: Channel) -> Text:
-    v = int(channel.value.pos / 255 * 100)
+    v = int(channel.as_fraction() * 100)
     return Text(f"{v:2}%")
 
 
@@ -555,6 +578,49 @@ class AddFixtureScreen(ModalScreen):
         self.app.pop_screen()
 
 
+class AddExpressionScreen(ModalScreen[Optional[ExpressionEFX]]):
+    """Create an ExpressionEFX from a typed expression."""
+
+    BINDINGS = [
+        Binding("escape", "app.pop_screen", "", show=False),
+    ]
+
+    def compose(self) -> ComposeResult:
+        g = Grid(
+            Label("Expression"),
+            Input(placeholder="sin(t * 2 + i * 0.3) / 2 + 0.5", id="expression"),
+            Label("Outputs"),
+            Input("4", id="channels"),
+            Label(""),
+            Label("", id="error"),
+            Button("Add", variant="primary", id="add"),
+            Button("Cancel", variant="default", id="cancel"),
+            id="dialog2",
+        )
+        yield g
+        g.border_title = "Add expression EFX"
+
+    def _submit(self) -> None:
+        expression = self.query_one("#expression", Input).value
+        try:
+            channels = int(self.query_one("#channels", Input).value)
+            # created here so the trial run's errors show in the dialog
+            efx = ExpressionEFX(expression, channels=channels)
+        except (ValueError, SyntaxError, TypeError) as e:
+            self.query_one("#error", Label).update(str(e))
+            return
+        self.dismiss(efx)
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        self._submit()
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id == "add":
+            self._submit()
+        else:
+            self.dismiss(None)
+
+
 class TextualPilot(App):
     """A Textual app to manage DMX lighting."""
 
@@ -0,0 +1,265 @@
+import math
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from channel import ChannelProp, IndexedByteChannelProp
+from registration import EFX, ThingWithTraits, register_efx
+from trait import Channel, Trait
+
+if TYPE_CHECKING:
+    from desk import Controller
+
+# State dicts (as used for presets) are nested name -> trait -> channel -> value.
+# Walking them every frame is slow, so ChannelIndex numbers every channel once
+# and state is compiled into parallel arrays of channel index and value.
+
+Compiled = Tuple[array, array]
+
+# easing curves map the fraction of the fade elapsed to the fraction of the
+# change applied, 0 -> 0 and 1 -> 1
+EASINGS: Dict[str, Callable[[float], float]] = {
+    "linear": lambda f: f,
+    "in": lambda f: f * f,
+    "out": lambda f: f * (2 - f),
+    "in_out": lambda f: f * f * (3 - 2 * f),
+    "sine": lambda f: 0.5 - 0.5 * math.cos(math.pi * f),
+}
+
+
+class ChannelIndex:
+    def __init__(self, objects: Dict[str, ThingWithTraits]) -> None:
+        self.props: List[ChannelProp] = []
+        self.traits: List[Trait] = []
+        # indexed values (colour wheels, gobos) make no sense part way between
+        self.snap: List[bool] = []
+        self.keys: List[Tuple[str, str, str]] = []
+        self._index: Dict[Tuple[str, str, str], int] = {}
+        for name, obj in objects.items():
+            for tk, trait in obj.trait_items():
+                if trait.is_global:
+                    continue
+                for ck, prop in trait.channel_items():
+                    self._index[(name, tk, ck)] = len(self.props)
+                    self.keys.append((name, tk, ck))
+                    self.props.append(prop)
+                    self.traits.append(trait)
+                    self.snap.append(isinstance(prop, IndexedByteChannelProp))
+
+    def __len__(self) -> int:
+        return len(self.props)
+
+    def compile(self, state: Dict[str, Any]) -> Compiled:
+        idx = array("I")
+        values = array("i")
+        for name, traits in state.items():
+            for tk, channels in traits.items():
+                for ck, v in channels.items():
+                    i = self._index.get((name, tk, ck))
+                    if i is not None:
+                        idx.append(i)
+                        values.append(v)
+        return idx, values
+
+    def to_state(self, idx: Sequence[int], values: Sequence[int]) -> Dict[str, Any]:
+        # inverse of compile
+        state: Dict[str, Any] = {}
+        for i, v in zip(idx, values):
+            name, tk, ck = self.keys[i]
+            state.setdefault(name, {}).setdefault(tk, {})[ck] = v
+        return state
+
+    def values(self, idx: Sequence[int]) -> array:
+        props = self.props
+        return array("i", [props[i].pos for i in idx])
+
+    def apply(self, idx: Sequence[int], values: Sequence[float]) -> None:
+        # set every channel first and then notify each changed trait just once,
+        # the same as Trait.set_state but without the dict walk
+        props = self.props
+        traits = self.traits
+        changed: Dict[Trait, None] = {}
+        for i, v in zip(idx, values):
+            if props[i].set(int(v)):
+                changed[traits[i]] = None
+        for t in changed:
+            t._changed(None)
+
+
+class Timeline:
+    # active fades as parallel lists of channel, start time, duration and
+    # start/end value. A channel only ever has one segment, a newer one replaces
+    # whatever it was doing. Channels that cannot be interpolated jump to their
+    # new value once snap_at of the way through.
+    def __init__(self, index: ChannelIndex, easing="linear", snap_at=0.0) -> None:
+        self.index = index
+        self.easing: Callable[[float], float] = EASINGS[easing]
+        self.snap_at = snap_at
+        self._idx: List[int] = []
+        self._t0: List[float] = []
+        self._dur: List[float] = []
+        self._v0: List[int] = []
+        self._v1: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._idx)
+
+    def add(
+        self,
+        now: float,
+        idx: Sequence[int],
+        targets: Sequence[int],
+        delays: Sequence[float],
+        durations: Sequence[float],
+    ) -> None:
+        replaced = set(idx)
+        self._keep([k for k, i in enumerate(self._idx) if i not in replaced])
+
+        current = self.index.values(idx)
+        for i, v0, v1, delay, dur in zip(idx, current, targets, delays, durations):
+            if v0 == v1:
+                continue
+            self._idx.append(i)
+            self._t0.append(now + delay)
+            self._dur.append(dur)
+            self._v0.append(v0)
+            self._v1.append(v1)
+
+    def clear(self) -> None:
+        self._idx, self._t0, self._dur, self._v0, self._v1 = [], [], [], [], []
+
+    def rebase(self, index: ChannelIndex) -> None:
+        # carry the live segments over to a rebuilt index, by channel name as
+        # the numbering changes when fixtures or EFX are added
+        if index is self.index:
+            return
+        keys = self.index.keys
+        new_idx = [index._index.get(keys[i]) for i in self._idx]
+        self._keep([k for k, i in enumerate(new_idx) if i is not None])
+        self._idx = [i for i in new_idx if i is not None]
+        self.index = index
+
+    def set_easing(self, easing: str) -> None:
+        self.easing = EASINGS[easing]
+
+    def evaluate(self, now: float) -> None:
+        snap = self.index.snap
+        ease = self.easing
+        snap_at = self.snap_at
+        out_idx: List[int] = []
+        out_val: List[float] = []
+        done = False
+        for i, t0, dur, v0, v1 in zip(
+            self._idx, self._t0, self._dur, self._v0, self._v1
+        ):
+            f = (now - t0) / dur if dur > 0 else (1.0 if now >= t0 else 0.0)
+            if f <= 0:
+                continue
+            out_idx.append(i)
+            if f >= 1:
+                done = True
+                out_val.append(v1)
+            elif snap[i]:
+                out_val.append(v1 if f >= snap_at else v0)
+            else:
+                out_val.append(v0 + (v1 - v0) * ease(f))
+        self.index.apply(out_idx, out_val)
+        if done:
+            self._drop_finished(now)
+
+    def _drop_finished(self, now: float) -> None:
+        self._keep(
+            [
+                k
+                for k, (t0, dur) in enumerate(zip(self._t0, self._dur))
+                if now < t0 + max(dur, 0)
+            ]
+        )
+
+    def _keep(self, keep: List[int]) -> None:
+        self._idx = [self._idx[k] for k in keep]
+        self._t0 = [self._t0[k] for k in keep]
+        self._dur = [self._dur[k] for k in keep]
+        self._v0 = [self._v0[k] for k in keep]
+        self._v1 = [self._v1[k] for k in keep]
+
+
+@register_efx
+class PresetCrossfader(EFX):
+    # live A/B mix between two entries of Controller.presets, like a video
+    # crossfader: fader at 0 is all A, at its maximum all B. Both presets are
+    # expanded to dense vectors over the union of their channels once, so a fader
+    # move is a single lerp. Channels only in one preset hold that value.
+    def __init__(
+        self,
+        controller: "Controller",
+        a: Optional[str] = None,
+        b: Optional[str] = None,
+        snap_at=0.5,
+    ) -> None:
+        super().__init__()
+        # global, so presets never capture (and then move) the fader itself
+        self.fader = Channel(pos_max=1000)
+        self.fader.is_global = True
+        self.fader._patch_listener(self.on_fader_change)
+        self.controller = controller
+        self.a = a
+        self.b = b
+        self.snap_at = snap_at
+        self._sources: Optional[Tuple[Compiled, Compiled]] = None
+        self._idx: List[int] = []
+        self._va: List[int] = []
+        self._delta: List[int] = []
+        self._vb: List[int] = []
+        self._snap: List[bool] = []
+        self._last: Optional[float] = None
+
+    def set_presets(self, a: str, b: str) -> None:
+        self.a = a
+        self.b = b
+        self._last = None
+        self.on_fader_change(self)
+
+    def set_fraction(self, x: float) -> None:
+        if not self.fader.set(round(x * self.fader.pos_max)):
+            # still apply if the presets have moved since
+            self.on_fader_change(self)
+
+    def set_midi(self, value: int) -> None:
+        # for MidiCC.bind_cc
+        self.set_fraction(value / 127)
+
+    def _compile(self) -> None:
+        # only redone if either preset has been saved over or channels added
+        if self.a is None or self.b is None:
+            raise ValueError("Crossfader needs two presets")
+        ca = self.controller.compiled_preset(self.a)
+        cb = self.controller.compiled_preset(self.b)
+        if self._sources is not None:
+            sa, sb = self._sources
+            if sa is ca and sb is cb:
+                return
+        self._sources = (ca, cb)
+        a: Dict[int, int] = dict(zip(*ca))
+        b: Dict[int, int] = dict(zip(*cb))
+        snap = self.controller.channel_index().snap
+        self._idx = sorted(a.keys() | b.keys())
+        self._va = [a[i] if i in a else b[i] for i in self._idx]
+        self._vb = [b[i] if i in b else a[i] for i in self._idx]
+        self._delta = [vb - va for va, vb in zip(self._va, self._vb)]
+        self._snap = [snap[i] for i in self._idx]
+        self._last = None
+
+    def on_fader_change(self, src: Any) -> None:
+        if self.a is None or self.b is None:
+            return
+        self._compile()
+        x = self.fader.as_fraction()
+        if x == self._last:
+            return
+        self._last = x
+        snap_b = x >= self.snap_at
+        values = [
+            (vb if snap_b else va) if s else va + d * x
+            for va, vb, d, s in zip(self._va, self._vb, self._delta, self._snap)
+        ]
+        self.controller.channel_index().apply(self._idx, values)
@@ -1,9 +1,15 @@
+import time
 from abc import ABC, abstractmethod
-from typing import List, Optional, Any, Iterator, Tuple, Dict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import List, Optional, Any, Iterator, Tuple, Dict, TYPE_CHECKING
 
 from channel import UniverseType
+from geometry import Placement
 from trait import OnOffTrait, Trait
 
+if TYPE_CHECKING:
+    from tempo import TempoClock
+
 
 class Pollable:
     def tick(self, showtime: float) -> None:
@@ -58,8 +64,24 @@ class Fixture(ThingWithTraits, ABC):
         self.universe: Optional[int] = None
         self.base: Optional[int] = None
         self.ch: int = ch
+        self.placement: Optional[Placement] = None
+        # seconds for the slowest colour/gobo wheel change, see stages.MoveInBlack
+        self.wheel_travel: float = 0.3
         super().__init__()
 
+    def set_placement(
+        self,
+        x: float,
+        y: float,
+        z: float,
+        yaw: float = 0,
+        pitch: float = 0,
+        roll: float = 0,
+    ) -> Placement:
+        # position in metres and orientation in degrees, see geometry.py
+        self.placement = Placement(x, y, z, yaw=yaw, pitch=pitch, roll=roll)
+        return self.placement
+
     @abstractmethod
     def patch(self, universe: int, base: int, data: UniverseType) -> None:
         self.universe = universe
@@ -69,6 +91,8 @@ class Fixture(ThingWithTraits, ABC):
 class EFX(ThingWithTraits, Pollable):
     def __init__(self):
         super().__init__()
+        # set by Controller.add_efx
+        self.tempo: Optional["TempoClock"] = None
 
 
 class EnabledEFX:
@@ -77,6 +101,83 @@ class EnabledEFX:
         self.enabled = OnOffTrait()
 
 
+class SyncedEFX:
+    # when sync is on the effect runs in beats of the controller's tempo clock
+    # rather than seconds of showtime
+    def __init__(self):
+        super().__init__()
+        self.sync = OnOffTrait()
+
+    def timebase(self, showtime: float) -> float:
+        tempo = getattr(self, "tempo", None)
+        if self.sync.value.pos > 0 and tempo is not None:
+            return tempo.beats
+        return showtime
+
+
+class BackgroundEFX(EFX, ABC):
+    # for effects too slow to run inside a frame. tick takes a snapshot of the
+    # inputs and hands it to compute on an executor, later ticks apply whichever
+    # result has finished and start the next. Outputs only change in apply, so
+    # a slow effect updates less often rather than holding up the frame.
+    #
+    # compute is a staticmethod, so with a ProcessPoolExecutor only the snapshot
+    # and result need to pickle.
+    _default_executor: Optional[Executor] = None
+
+    def __init__(self, executor: Optional[Executor] = None):
+        super().__init__()
+        self.executor = executor
+        self._future: Optional[Future] = None
+        self._submitted: float = 0
+        self.compute_time: float = 0
+        self.error: Optional[BaseException] = None
+
+    def snapshot(self, showtime: float) -> Any:
+        return showtime
+
+    @staticmethod
+    @abstractmethod
+    def compute(snapshot: Any) -> Any:
+        pass
+
+    def apply(self, result: Any) -> None:
+        pass
+
+    def _get_executor(self) -> Executor:
+        if self.executor is not None:
+            return self.executor
+        if BackgroundEFX._default_executor is None:
+            BackgroundEFX._default_executor = ThreadPoolExecutor(
+                thread_name_prefix="efx"
+            )
+        return BackgroundEFX._default_executor
+
+    def tick(self, showtime: float) -> None:
+        future = self._future
+        if future is not None:
+            if not future.done():
+                return
+            self._future = None
+            self.compute_time = time.monotonic() - self._submitted
+            try:
+                self.apply(future.result())
+                self.error = None
+            except Exception as e:
+                if self.error is None:
+                    print(f"{self.name}: {e!r}")
+                self.error = e
+        self._submitted = time.monotonic()
+        self._future = self._get_executor().submit(
+            type(self).compute, self.snapshot(showtime)
+        )
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        # for tests and shutdown, block until the running compute finishes
+        if self._future is not None:
+            self._future.exception(timeout)
+
+
 fixture_class_list: List[type[Fixture]] = []
 efx_class_list: List[type[EFX]] = []
 
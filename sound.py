@@ -0,0 +1,296 @@
+# Sound to light analysis. PCM is read and analysed in blocks by a background
+# thread, the tick only picks up the most recent result, so slow audio never
+# holds up a DMX frame.
+#
+# Band energies come from an FFT of each block, onsets from the spectral flux
+# (sum of positive changes in magnitude) against its recent average, and beats
+# are onsets in the lowest band spaced at least min_beat apart.
+
+import cmath
+import collections
+import math
+import os
+import stat
+import sys
+import threading
+import time
+import wave
+from array import array
+from typing import BinaryIO, Deque, List, Optional
+
+from registration import EFX
+from trait import Channel, IntensityChannel
+
+
+class PcmSource:
+    # raw signed 16-bit little-endian PCM, eg. `arecord -f S16_LE | pilot.py`
+    def __init__(
+        self, stream: Optional[BinaryIO], samplerate=44100, channels=1
+    ) -> None:
+        self.stream = stream
+        self.samplerate = samplerate
+        self.channels = channels
+
+    def _read_bytes(self, nframes: int) -> bytes:
+        if self.stream is None:
+            return b""
+        return self.stream.read(nframes * 2 * self.channels)
+
+    def read(self, nframes: int) -> List[float]:
+        # returns up to nframes mono samples between -1 and 1, [] at end of stream
+        raw = self._read_bytes(nframes)
+        usable = len(raw) - len(raw) % (2 * self.channels)
+        pcm = array("h")
+        pcm.frombytes(raw[:usable])
+        if sys.byteorder == "big":
+            pcm.byteswap()
+        ch = self.channels
+        if ch == 1:
+            return [s / 32768 for s in pcm]
+        return [sum(pcm[i : i + ch]) / (32768 * ch) for i in range(0, len(pcm), ch)]
+
+    def close(self) -> None:
+        if self.stream is not None:
+            self.stream.close()
+
+
+class WavSource(PcmSource):
+    def __init__(self, filename_or_stream) -> None:
+        self._wav = wave.open(filename_or_stream, "rb")
+        if self._wav.getsampwidth() != 2:
+            raise ValueError("only 16-bit WAV files are supported")
+        super().__init__(
+            stream=None,
+            samplerate=self._wav.getframerate(),
+            channels=self._wav.getnchannels(),
+        )
+
+    def _read_bytes(self, nframes: int) -> bytes:
+        return self._wav.readframes(nframes)
+
+    def close(self) -> None:
+        self._wav.close()
+
+
+def open_audio(name: str, samplerate=44100, channels=1) -> PcmSource:
+    # "-" or a named pipe reads raw PCM, anything else is a WAV file. Opening a
+    # pipe waits for something to start writing to it
+    if name == "-":
+        return PcmSource(sys.stdin.buffer, samplerate=samplerate, channels=channels)
+    if stat.S_ISFIFO(os.stat(name).st_mode):
+        return PcmSource(open(name, "rb"), samplerate=samplerate, channels=channels)
+    return WavSource(name)
+
+
+def fft(x: List[complex]) -> List[complex]:
+    # iterative radix-2, len(x) must be a power of two
+    n = len(x)
+    a = list(x)
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            a[i], a[j] = a[j], a[i]
+    size = 2
+    while size <= n:
+        w_step = cmath.exp(-2j * math.pi / size)
+        half = size // 2
+        for start in range(0, n, size):
+            w = 1 + 0j
+            for k in range(start, start + half):
+                t = w * a[k + half]
+                a[k + half] = a[k] - t
+                a[k] = a[k] + t
+                w *= w_step
+        size *= 2
+    return a
+
+
+class AnalysisResult:
+    def __init__(
+        self, time: float, level: float, bands: List[float], onset: bool, beat: bool
+    ) -> None:
+        self.time = time
+        self.level = level
+        self.bands = bands
+        self.onset = onset
+        self.beat = beat
+
+
+class AudioAnalyser:
+    def __init__(
+        self,
+        samplerate: int,
+        block=512,
+        bands=4,
+        fmin=40.0,
+        threshold=1.5,
+        history=20,
+        min_beat=0.3,
+    ) -> None:
+        if block & (block - 1):
+            raise ValueError("block size must be a power of two")
+        self.samplerate = samplerate
+        self.block = block
+        self.threshold = threshold
+        self.min_beat = min_beat
+        self.time = 0.0
+        self._window = [
+            0.5 - 0.5 * math.cos(2 * math.pi * i / (block - 1)) for i in range(block)
+        ]
+        # log spaced band edges as FFT bin numbers
+        fmax = samplerate / 2
+        nbins = block // 2
+        edges = [fmin * (fmax / fmin) ** (b / bands) for b in range(bands + 1)]
+        self._edges = [min(nbins, max(1, int(f * block / samplerate))) for f in edges]
+        self._edges[0] = 1
+        self._last_mag = [0.0] * nbins
+        self._flux: Deque[float] = collections.deque(maxlen=history)
+        self._low_flux: Deque[float] = collections.deque(maxlen=history)
+        self._last_beat = -math.inf
+        self.beat_times: Deque[float] = collections.deque(maxlen=9)
+
+    def process(self, samples: List[float]) -> AnalysisResult:
+        n = self.block
+        if len(samples) < n:
+            samples = samples + [0.0] * (n - len(samples))
+        level = math.sqrt(sum(s * s for s in samples) / n)
+        spectrum = fft([s * w for s, w in zip(samples, self._window)])
+        mag = [abs(c) / n for c in spectrum[: n // 2]]
+
+        bands = []
+        for lo, hi in zip(self._edges, self._edges[1:]):
+            bands.append(sum(m * m for m in mag[lo : max(hi, lo + 1)]))
+
+        flux = sum(max(0.0, m - l) for m, l in zip(mag, self._last_mag))
+        lo, hi = self._edges[0], max(self._edges[1], self._edges[0] + 1)
+        low_flux = sum(
+            max(0.0, m - l) for m, l in zip(mag[lo:hi], self._last_mag[lo:hi])
+        )
+        self._last_mag = mag
+
+        onset = self._is_peak(flux, self._flux)
+        beat = self._is_peak(low_flux, self._low_flux)
+        if beat and self.time - self._last_beat >= self.min_beat:
+            self._last_beat = self.time
+            self.beat_times.append(self.time)
+        else:
+            beat = False
+
+        result = AnalysisResult(self.time, level, bands, onset, beat)
+        self.time += n / self.samplerate
+        return result
+
+    def _is_peak(self, value: float, history: Deque[float]) -> bool:
+        mean = sum(history) / len(history) if history else 0.0
+        history.append(value)
+        return value > 1e-6 and value > mean * self.threshold
+
+    def bpm(self) -> float:
+        # median interval between the recent beats
+        if len(self.beat_times) < 3:
+            return 0.0
+        t = list(self.beat_times)
+        intervals = sorted(b - a for a, b in zip(t, t[1:]))
+        return 60 / intervals[len(intervals) // 2]
+
+
+class SoundToLight(EFX):
+    # outputs b0...bN band energies, level, onset and beat (255 for the frame
+    # following a detection, otherwise 0) and the estimated bpm. Each output is
+    # scaled against a slowly decaying peak so quiet sources still fill the range.
+    # Not registered, it does nothing until the show gives it a source and
+    # starts it, see vh.py --audio.
+    def __init__(
+        self,
+        source: Optional[PcmSource] = None,
+        bands=4,
+        block=512,
+        realtime=True,
+        decay=0.999,
+    ) -> None:
+        super().__init__()
+        self.level = IntensityChannel()
+        self.onset = IntensityChannel()
+        self.beat = IntensityChannel()
+        self.bpm = Channel(pos_max=300)
+        self._outputs: List[Channel] = []
+        for i in range(bands):
+            o = IntensityChannel()
+            self._outputs.append(o)
+            setattr(self, f"b{i}", o)
+
+        self._source = source
+        self._bands = bands
+        self._block = block
+        self._realtime = realtime
+        self._decay = decay
+        self._peaks = [1e-9] * (bands + 1)
+        # written by the worker, read by tick. deque appends and pops are atomic
+        self._results: Deque[AnalysisResult] = collections.deque(maxlen=1)
+        self._onsets = 0
+        self._beats = 0
+        self._seen_onsets = 0
+        self._seen_beats = 0
+        self._bpm = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._source is None:
+            raise ValueError("no audio source")
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(self._source,), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, source: PcmSource) -> None:
+        analyser = AudioAnalyser(
+            source.samplerate, block=self._block, bands=self._bands
+        )
+        started = time.monotonic()
+        while not self._stop.is_set():
+            samples = source.read(self._block)
+            if not samples:
+                break
+            result = analyser.process(samples)
+            self._onsets += result.onset
+            self._beats += result.beat
+            self._bpm = analyser.bpm()
+            self._results.append(result)
+            if self._realtime:
+                # files are read faster than they would play, pipes block by themselves
+                ahead = analyser.time - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        source.close()
+
+    def tick(self, counter: float) -> None:
+        onsets, beats = self._onsets, self._beats
+        self.onset.set(255 if onsets != self._seen_onsets else 0)
+        self.beat.set(255 if beats != self._seen_beats else 0)
+        self._seen_onsets, self._seen_beats = onsets, beats
+        self.bpm.set(round(self._bpm))
+
+        try:
+            result = self._results.pop()
+        except IndexError:
+            return
+        values = result.bands + [result.level]
+        for i, v in enumerate(values):
+            self._peaks[i] = max(v, self._peaks[i] * self._decay)
+        for o, v, peak in zip(self._outputs, values, self._peaks):
+            o.set(int(255 * v / peak))
+        self.level.set(int(255 * result.level / self._peaks[-1]))
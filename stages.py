@@ -0,0 +1,314 @@
+import functools
+import heapq
+import math
+from abc import ABC, abstractmethod
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from channel import ChannelProp, FineChannelProp, IndexedByteChannelProp
+from registration import Fixture
+from trait import IndexedChannel, IntensityChannel, Trait
+
+if TYPE_CHECKING:
+    from desk import Controller, UniverseKey
+
+# Output stages post-process the DMX frame after every EFX, fade and layer has
+# run, just before it is sent. The universes the traits write into keep the
+# values asked for, the stages work on a copy, so they never feed back into
+# presets, the UI or each other's next frame.
+#
+#   slew = controller.add_output_stage(SlewLimiter())
+#   slew.add_fixture(head, rate=0.5)          # full travel in no less than 2s
+#   slew.add(wash.intensity, tau=0.05)        # smooth dimmer jitter
+
+
+class OutputStage(ABC):
+    def __init__(self) -> None:
+        self.controller: Optional["Controller"] = None
+
+    def attach(self, controller: "Controller") -> None:
+        self.controller = controller
+
+    def invalidate(self) -> None:
+        # called when fixtures are patched
+        pass
+
+    @abstractmethod
+    def process(
+        self, frames: Dict["UniverseKey", bytearray], frame_time: float
+    ) -> None:
+        # frame_time is the showtime the frame is sent at, see Controller._tick_once
+        pass
+
+    def _universe_keys(self) -> Dict[int, "UniverseKey"]:
+        # channels are found through the universe buffer they are patched into
+        if self.controller is None:
+            raise ValueError("Add the stage to a controller first")
+        return {id(data): key for key, data in self.controller.universes.items()}
+
+
+class SlewLimiter(OutputStage):
+    # per channel max slew rate (fraction of full range per second) and/or a one
+    # pole low pass filter with time constant tau seconds. 16-bit channels are
+    # filtered at full resolution. Indexed channels (gobos, colour wheels) are
+    # left alone, a slow gobo wheel is just a wrong gobo for longer.
+    def __init__(self) -> None:
+        super().__init__()
+        self._wanted: List[Tuple[ChannelProp, float, float]] = []
+        self._dirty = True
+        # compiled from _wanted, one entry per channel
+        self._universe: List["UniverseKey"] = []
+        self._offset = array("I")
+        self._fine = array("b")
+        self._rate = array("d")
+        self._tau = array("d")
+        self._value = array("d")
+        self._last: Optional[float] = None
+
+    def add(self, trait: Trait, rate: float = 0, tau: float = 0) -> None:
+        for _, prop in trait.channel_items():
+            if not isinstance(prop, IndexedByteChannelProp):
+                self._wanted.append((prop, rate, tau))
+        self._dirty = True
+
+    def invalidate(self) -> None:
+        self._dirty = True
+
+    def add_fixture(self, fixture: Fixture, rate: float = 0, tau: float = 0) -> None:
+        for _, trait in fixture.trait_items():
+            self.add(trait, rate=rate, tau=tau)
+
+    def _compile(self) -> None:
+        universes = self._universe_keys()
+        # channels already moving carry on from where they are
+        old = {
+            (key, offset): v
+            for key, offset, v in zip(self._universe, self._offset, self._value)
+        }
+        self._universe = []
+        self._offset = array("I")
+        self._fine = array("b")
+        self._rate = array("d")
+        self._tau = array("d")
+        for prop, rate, tau in self._wanted:
+            key = universes.get(id(prop.data))
+            if key is None:
+                continue
+            fine = isinstance(prop, FineChannelProp)
+            self._universe.append(key)
+            self._offset.append(prop.base)
+            self._fine.append(fine)
+            self._rate.append(rate * (0xFFFF if fine else 0xFF))
+            self._tau.append(tau)
+        self._value = array(
+            "d",
+            [old.get(ko, math.nan) for ko in zip(self._universe, self._offset)],
+        )
+        self._dirty = False
+
+    def process(
+        self, frames: Dict["UniverseKey", bytearray], frame_time: float
+    ) -> None:
+        if self._dirty:
+            self._compile()
+        dt = 0.0 if self._last is None else max(0.0, frame_time - self._last)
+        self._last = frame_time
+
+        value = self._value
+        for k, (key, offset, fine, rate, tau) in enumerate(
+            zip(self._universe, self._offset, self._fine, self._rate, self._tau)
+        ):
+            frame = frames[key]
+            if fine:
+                target = float((frame[offset] << 8) | frame[offset + 1])
+            else:
+                target = float(frame[offset])
+            v = value[k]
+            if math.isnan(v):
+                # start wherever the show is rather than sweeping from zero
+                value[k] = target
+                continue
+
+            if tau > 0:
+                target = v + (target - v) * (1 - math.exp(-dt / tau))
+            if rate > 0:
+                step = rate * dt
+                target = min(v + step, max(v - step, target))
+            value[k] = target
+
+            out = int(target + 0.5)
+            if fine:
+                frame[offset] = out >> 8
+                frame[offset + 1] = out & 0xFF
+            else:
+                frame[offset] = out
+
+
+STROBE_MODES = ["quantize", "dither"]
+
+
+class Strobe(OutputStage):
+    # flashes intensity channels by blanking them in the output frame. A strobe
+    # EFX toggling channels on tick beats against the frame rate, so here the
+    # edges are worked out per output frame instead:
+    #
+    #  quantize  period rounded to a whole number of frames, every flash the
+    #            same length, the rate is only as exact as the frame rate allows
+    #  dither    the exact rate, each edge lands on the frame nearest to it by
+    #            the actual send times, so flashes vary by one frame
+    def __init__(self, rate=10.0, duty=0.5, mode="quantize") -> None:
+        super().__init__()
+        if mode not in STROBE_MODES:
+            raise ValueError(f"Unknown strobe mode {mode}")
+        self.rate = rate
+        self.duty = duty
+        self.mode = mode
+        self.enabled = False
+        self._wanted: List[ChannelProp] = []
+        self._dirty = True
+        self._universe: List["UniverseKey"] = []
+        self._offset = array("I")
+        self._width = array("B")
+        self._frame = 0
+        self._phase = 0.0
+        self._last: Optional[float] = None
+
+    def add(self, trait: Trait) -> None:
+        for _, prop in trait.channel_items():
+            self._wanted.append(prop)
+        self._dirty = True
+
+    def invalidate(self) -> None:
+        self._dirty = True
+
+    def set_enabled(self, enabled: bool) -> None:
+        # each run starts on a flash
+        if enabled and not self.enabled:
+            self._frame = 0
+            self._phase = 0.0
+            self._last = None
+        self.enabled = enabled
+
+    def _compile(self) -> None:
+        universes = self._universe_keys()
+        self._universe = []
+        self._offset = array("I")
+        self._width = array("B")
+        for prop in self._wanted:
+            key = universes.get(id(prop.data))
+            if key is not None:
+                self._universe.append(key)
+                self._offset.append(prop.base)
+                self._width.append(2 if isinstance(prop, FineChannelProp) else 1)
+        self._dirty = False
+
+    def frame_period(self) -> int:
+        # quantize mode, frames per flash and frames lit
+        assert self.controller is not None
+        return max(2, round(self.controller.target_fps / self.rate))
+
+    def _lit(self, frame_time: float) -> bool:
+        if self.mode == "quantize":
+            period = self.frame_period()
+            on = min(period - 1, max(1, round(period * self.duty)))
+            lit = self._frame % period < on
+            self._frame += 1
+            return lit
+
+        if self._last is not None:
+            self._phase += (frame_time - self._last) * self.rate
+        self._last = frame_time
+        # sample half way to the next frame so edges round to the nearest frame
+        assert self.controller is not None
+        half = 0.5 * self.rate / self.controller.target_fps
+        return (self._phase + half) % 1 < self.duty
+
+    def process(
+        self, frames: Dict["UniverseKey", bytearray], frame_time: float
+    ) -> None:
+        if not self.enabled:
+            return
+        if self._dirty:
+            self._compile()
+        if self._lit(frame_time):
+            return
+        for key, offset, width in zip(self._universe, self._offset, self._width):
+            frames[key][offset : offset + width] = bytes(width)
+
+
+WHEEL_TRAITS = ["spot_cw", "spot_gobo", "shutter"]
+
+
+class MoveInBlack(OutputStage):
+    # watches the wheel traits of every fixture on the controller, and when one
+    # changes blanks that fixture's intensity channels in the output frame for
+    # its wheel_travel seconds, so the wheel is never seen turning. Deadlines
+    # sit in a heap, a frame only looks at fixtures actually changing.
+    def __init__(self, wheels: List[str] = WHEEL_TRAITS) -> None:
+        super().__init__()
+        self.wheels = wheels
+        self._dirty = True
+        self._watched: Dict[Trait, None] = {}
+        # fixture -> [(universe, offset)] of its intensity channels
+        self._intensity: Dict[Fixture, List[Tuple["UniverseKey", int]]] = {}
+        # (deadline, seq, fixture), entries that no longer match _until are stale
+        self._heap: List[Tuple[float, int, Fixture]] = []
+        self._until: Dict[Fixture, float] = {}
+        self._pending: Dict[Fixture, None] = {}
+        self._seq = 0
+
+    def attach(self, controller: "Controller") -> None:
+        super().attach(controller)
+        self._dirty = True
+
+    def invalidate(self) -> None:
+        self._dirty = True
+
+    def _compile(self) -> None:
+        assert self.controller is not None
+        universes = self._universe_keys()
+        self._intensity = {}
+        for fixture in self.controller.fixtures:
+            blank = []
+            for tk, trait in fixture.trait_items():
+                if isinstance(trait, IndexedChannel) and tk in self.wheels:
+                    if trait not in self._watched:
+                        self._watched[trait] = None
+                        trait._patch_listener(
+                            functools.partial(self.on_wheel_change, fixture)
+                        )
+                elif isinstance(trait, IntensityChannel):
+                    for _, prop in trait.channel_items():
+                        key = universes.get(id(prop.data))
+                        if key is not None:
+                            blank.append((key, prop.base))
+            self._intensity[fixture] = blank
+        self._dirty = False
+
+    def on_wheel_change(self, fixture: Fixture, source: Any) -> None:
+        # the wheel starts to move when the next frame is sent
+        self._pending[fixture] = None
+
+    def blanked(self) -> List[Fixture]:
+        return list(self._until) + [f for f in self._pending if f not in self._until]
+
+    def process(
+        self, frames: Dict["UniverseKey", bytearray], frame_time: float
+    ) -> None:
+        if self._dirty:
+            self._compile()
+        heap = self._heap
+        until = self._until
+        for fixture in self._pending:
+            deadline = frame_time + fixture.wheel_travel
+            until[fixture] = deadline
+            self._seq += 1
+            heapq.heappush(heap, (deadline, self._seq, fixture))
+        self._pending.clear()
+        while heap and heap[0][0] <= frame_time:
+            deadline, _, fixture = heapq.heappop(heap)
+            if until.get(fixture) == deadline:
+                del until[fixture]
+        for fixture in until:
+            for key, offset in self._intensity.get(fixture, []):
+                frames[key][offset] = 0
@@ -0,0 +1,73 @@
+import collections
+from typing import Any, Deque, Optional
+
+from registration import Pollable, ThingWithTraits
+from trait import Channel, OnOffTrait
+
+
+class TempoClock(ThingWithTraits, Pollable):
+    # shared musical time for the whole show. The controller ticks this once per
+    # frame before any EFX, which then read beats/beat_phase/bar_phase rather than
+    # working from showtime themselves.
+    def __init__(self, bpm=120.0, beats_per_bar=4, tap_timeout=2.0) -> None:
+        super().__init__()
+        self.bpm = Channel(value=round(bpm), pos_max=300)
+        self.tap = OnOffTrait()
+        self.beats_per_bar = beats_per_bar
+        self.tap_timeout = tap_timeout
+        self.beats: float = 0
+        self.beat_phase: float = 0
+        self.bar_phase: float = 0
+        self._bpm = float(bpm)
+        self._last_showtime: Optional[float] = None
+        self._taps: Deque[float] = collections.deque(maxlen=8)
+        self._setting = False
+        self.bpm._patch_listener(self.on_bpm_change)
+        self.tap._patch_listener(self.on_tap)
+
+    def get_bpm(self) -> float:
+        return self._bpm
+
+    def set_bpm(self, bpm: float) -> None:
+        self._bpm = max(1.0, float(bpm))
+        self._setting = True
+        self.bpm.set(round(self._bpm))
+        self._setting = False
+
+    def on_bpm_change(self, src: Any) -> None:
+        if not self._setting:
+            self._bpm = max(1.0, float(self.bpm.value.pos))
+
+    def on_tap(self, src: Any) -> None:
+        if self.tap.value.pos:
+            self.tap_tempo()
+
+    def tap_tempo(self, when: Optional[float] = None) -> None:
+        # taps more than tap_timeout apart start a new measurement
+        last = self._last_showtime or 0
+        if when is None:
+            when = last
+        if self._taps and when - self._taps[-1] > self.tap_timeout:
+            self._taps.clear()
+        self._taps.append(when)
+        if len(self._taps) >= 2:
+            interval = (self._taps[-1] - self._taps[0]) / (len(self._taps) - 1)
+            if interval > 0:
+                self.set_bpm(60 / interval)
+        # the tap lands on a beat
+        ahead = (when - last) * self._bpm / 60
+        self.beats = round(self.beats + ahead) - ahead
+        self._update_phase()
+
+    def tick(self, showtime: float) -> None:
+        if self._last_showtime is not None:
+            self.beats += (showtime - self._last_showtime) * self._bpm / 60
+        self._last_showtime = showtime
+        self._update_phase()
+
+    def _update_phase(self) -> None:
+        self.beat_phase = self.beats % 1
+        self.bar_phase = (self.beats % self.beats_per_bar) / self.beats_per_bar
+
+    def __repr__(self):
+        return f"bpm={self._bpm:.1f} beat={self.beats:.2f} bar={self.bar_phase:.2f}"
@@ -0,0 +1,556 @@
+import asyncio
+import struct
+
+import pytest
+
+from aio_ola import (
+    DmxFrameEncoder,
+    DmxInput,
+    OlaClient,
+    OlaClientPool,
+    OlaDiscovery,
+    ReadbackVerifier,
+    decode_dmx,
+    decode_rpc,
+)
+from desk import Controller
+from olad_standin import OladStandin
+from trait import Channel
+from ola.proto import Ack, DeviceInfo, DmxData, PluginInfo, PortInfo
+from ola.rpc import RpcMessage, Type
+
+
+class FakeOlad:
+    # records every RpcMessage and answers REQUESTs with an empty Ack, except
+    # for methods in hold which never get a reply
+    def __init__(self):
+        self.received = []
+        self.tasks = []
+        self.hold = set()
+
+    async def start(self, port=0):
+        self.server = await asyncio.start_server(self._client, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _client(self, reader, writer):
+        self.tasks.append(asyncio.current_task())
+        try:
+            while True:
+                (h,) = struct.unpack("<L", await reader.readexactly(4))
+                m = RpcMessage().parse(await reader.readexactly(h & 0x0FFFFFF))
+                self.received.append(m)
+                if m.type == Type.REQUEST and m.name not in self.hold:
+                    reply = bytes(
+                        RpcMessage(type=Type.RESPONSE, id=m.id, buffer=bytes(Ack()))
+                    )
+                    writer.write(struct.pack("<L", (1 << 28) | len(reply)) + reply)
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        self.server.close()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_streaming_set_dmx():
+    olad = FakeOlad()
+    port = await olad.start()
+    client = OlaClient(port=port)
+    await client.connect()
+
+    # streamed frames return at once, with no reply to wait for
+    for i in range(3):
+        assert await client.set_dmx(1, bytes([i, 2, 3])) is None
+        await asyncio.sleep(0.01)
+    assert client._handlers == {}
+
+    # control RPCs and non-streaming clients still get an Ack back
+    client.streaming = False
+    assert await client.set_dmx(2, b"\x09") == Ack()
+
+    names = [(Type(m.type), m.name) for m in olad.received]
+    assert names == [(Type.STREAM_REQUEST, "StreamDmxData")] * 3 + [
+        (Type.REQUEST, "UpdateDmxData")
+    ]
+    assert DmxData().parse(olad.received[2].buffer) == DmxData(
+        universe=1, data=bytes([2, 2, 3])
+    )
+    await client.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_stale_frames_coalesced():
+    olad = FakeOlad()
+    port = await olad.start()
+    client = OlaClient(port=port)
+    await client.connect()
+
+    # frames queued faster than the writer runs, only the latest per
+    # universe goes out
+    buf = bytearray(4)
+    for i in range(5):
+        buf[0] = i
+        for universe in (1, 2):
+            await client.set_dmx(universe, buf)
+    assert client.stats()["queued"] == 2
+    await asyncio.sleep(0.05)
+
+    sent = [DmxData().parse(m.buffer) for m in olad.received]
+    assert sent == [
+        DmxData(universe=1, data=bytes([4, 0, 0, 0])),
+        DmxData(universe=2, data=bytes([4, 0, 0, 0])),
+    ]
+    assert client.coalesced == 8
+    assert client.frames_sent == 2
+    await client.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_request_lifecycle():
+    olad = FakeOlad()
+    port = await olad.start()
+    client = OlaClient(port=port, streaming=False, max_in_flight=2)
+    await client.connect()
+
+    for i in range(50):
+        await client.set_dmx(1, bytes([i]))
+    # handlers are removed as replies arrive
+    assert client._handlers == {}
+    assert client.stats()["completed"] == 50
+    assert client.rtt > 0
+
+    # stalled requests time out and are cleaned up, at most 2 are outstanding
+    client.timeout = 0.05
+    olad.hold.add("GetDmx")
+    tasks = [asyncio.create_task(client.get_dmx(1)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    assert client.stats()["in_flight"] == 2
+    assert client.stats()["waiting"] == 1
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, asyncio.TimeoutError) for r in results)
+    assert client.timeouts == 3
+    assert client._handlers == {}
+
+    # a frame that times out is dropped rather than stopping the show
+    olad.hold.add("UpdateDmxData")
+    assert await client.set_dmx(1, b"\x01") is None
+    assert client.timeouts == 4
+
+    # losing the connection fails whatever is waiting straight away
+    client.timeout = 5
+    task = asyncio.create_task(client.get_dmx(1))
+    await asyncio.sleep(0.01)
+    await olad.close()
+    with pytest.raises(ConnectionError):
+        await task
+    assert client._handlers == {}
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_request_cancelled_as_reply_arrives():
+    olad = OladStandin()
+    olad.hold.add("GetDmx")
+    port = await olad.start()
+    client = OlaClient(port=port)
+    await client.connect()
+
+    task = asyncio.create_task(client.get_dmx(1))
+    await asyncio.sleep(0.01)
+    # the reply and the cancel land together, the cancel must still win
+    ((_, fut),) = client._handlers.values()
+    fut.set_result(DmxData(universe=1))
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert client._handlers == {}
+    await client.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_reconnect():
+    olad = FakeOlad()
+    port = await olad.start()
+    client = OlaClient(port=port, min_backoff=0.01, max_backoff=0.02)
+    controller = Controller()
+    controller.add_network(client)
+    states = []
+    controller.nodes.changed.sub(lambda node: states.append(node.state))
+    assert client.node in controller.nodes
+
+    assert await client.connect()
+    universe = bytearray(4)
+    await client.set_dmx(1, universe)
+    await client.set_dmx(2, bytes([2]))
+    await asyncio.sleep(0.01)
+    assert len(olad.received) == 2
+
+    # olad goes away, frames carry on being accepted without blocking
+    await olad.close()
+    await asyncio.sleep(0.05)
+    assert not client.connected
+    assert client.node.state.startswith("retry")
+    universe[0] = 9
+    assert await client.set_dmx(1, universe) is None
+
+    # and comes back, the latest frame of every universe is sent again
+    olad = FakeOlad()
+    await olad.start(port)
+    await asyncio.sleep(0.1)
+    assert client.connected
+    assert client.reconnects == 1
+    assert sorted(DmxData().parse(m.buffer).universe for m in olad.received) == [1, 2]
+    assert DmxData().parse(olad.received[0].buffer).data == bytes([9, 0, 0, 0])
+    assert states[:2] == ["connecting", "connected"]
+    assert "disconnected" in states
+    assert states[-1] == "connected"
+
+    await client.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_shards_by_universe():
+    olad = FakeOlad()
+    port = await olad.start()
+    pool = OlaClientPool(port=port, connections=3)
+    controller = Controller()
+    controller.add_network(pool)
+    assert [n.name for n in controller.nodes] == ["OLA-0", "OLA-1", "OLA-2"]
+    assert await pool.connect()
+
+    # stable, and spread over every connection
+    shards = [pool.shard(u) for u in range(1, 17)]
+    assert shards == [pool.shard(u) for u in range(1, 17)]
+    assert set(shards) == set(pool.clients)
+
+    for u in range(1, 17):
+        await pool.set_dmx(u, bytes([u]))
+    await asyncio.sleep(0.05)
+    assert len(olad.received) == 16
+    assert pool.stats()["frames_sent"] == 16
+    for c in pool.clients:
+        assert c.frames_sent == shards.count(c)
+    await pool.close()
+    await olad.close()
+
+
+def betterproto_frame(type, req_id, name, universe, data, priority):
+    inner = DmxData(universe=universe, data=bytes(data), priority=priority)
+    rpc = bytes(RpcMessage(type=type, id=req_id, name=name, buffer=bytes(inner)))
+    return struct.pack("<L", (1 << 28) | len(rpc)) + rpc
+
+
+@pytest.mark.parametrize("universe", [0, 1, 127, 128, 70000, -1])
+@pytest.mark.parametrize("size", [0, 1, 127, 128, 512])
+@pytest.mark.parametrize("priority", [0, 100, 200])
+def test_encoder_matches_betterproto(universe, size, priority):
+    encoder = DmxFrameEncoder()
+    data = bytearray(i & 0xFF for i in range(size))
+    for type, req_id, name in [
+        (Type.STREAM_REQUEST, 0, "StreamDmxData"),
+        (Type.REQUEST, 1, "UpdateDmxData"),
+        (Type.REQUEST, 0xFFFFFFFF, "UpdateDmxData"),
+    ]:
+        frame = encoder.encode(type, req_id, name, universe, data, priority)
+        assert bytes(frame) == betterproto_frame(
+            type, req_id, name, universe, data, priority
+        )
+
+
+def test_encoder_reuses_buffer():
+    encoder = DmxFrameEncoder()
+    a = encoder.encode(Type.STREAM_REQUEST, 0, "StreamDmxData", 1, bytes(512))
+    b = encoder.encode(Type.STREAM_REQUEST, 0, "StreamDmxData", 1, bytes(512))
+    assert a.obj is b.obj
+    # grows for a frame bigger than a universe
+    c = encoder.encode(Type.STREAM_REQUEST, 0, "StreamDmxData", 1, bytes(1024))
+    assert bytes(c) == betterproto_frame(
+        Type.STREAM_REQUEST, 0, "StreamDmxData", 1, bytes(1024), 0
+    )
+
+
+class BackpressuredWriter:
+    # sends straight away until blocked, then queues what it is given by
+    # reference, as CPython 3.12's selector transport does
+    def __init__(self):
+        self.blocked = False
+        self.sent = bytearray()
+        self.queued = []
+        self.transport = self
+
+    def write(self, data):
+        if self.blocked:
+            self.queued.append(data)
+        else:
+            self.sent += data
+
+    def get_write_buffer_size(self):
+        return sum(len(d) for d in self.queued)
+
+    def unblock(self):
+        for d in self.queued:
+            self.sent += d
+        self.queued = []
+        self.blocked = False
+
+
+def test_write_dmx_backpressured():
+    client = OlaClient()
+    writer = BackpressuredWriter()
+    client._writer = writer  # type: ignore
+    frames = [bytes([i]) * 512 for i in range(6)]
+
+    def write(data):
+        client._write_dmx(Type.STREAM_REQUEST, 0, "StreamDmxData", 1, data, 0)
+        return client._encoders[1]._buf
+
+    first = write(frames[0])
+    writer.blocked = True
+    # every queued frame reaches the wire as it was, none overwritten
+    second = write(frames[1])
+    assert second is not first
+    assert write(frames[2]) is not second
+    write(frames[3])
+    assert bytes(client._encoders[1].last_data()) == frames[3]
+    writer.unblock()
+    # and once the socket keeps up the buffer is reused again
+    buf = write(frames[4])
+    assert write(frames[5]) is buf
+    assert writer.sent == b"".join(
+        betterproto_frame(Type.STREAM_REQUEST, 0, "StreamDmxData", 1, data, 0)
+        for data in frames
+    )
+
+
+@pytest.mark.parametrize("universe", [0, 1, 128, -1])
+@pytest.mark.parametrize("size", [0, 1, 512])
+def test_decode_matches_betterproto(universe, size):
+    data = bytes(i & 0xFF for i in range(size))
+    frame = betterproto_frame(Type.REQUEST, 300, "UpdateDmxData", universe, data, 100)
+    type, req_id, name, buffer = decode_rpc(memoryview(frame)[4:])
+    assert (type, req_id, name) == (Type.REQUEST, 300, b"UpdateDmxData")
+    u, view, priority = decode_dmx(buffer)
+    assert (u, view, priority) == (universe, data, 100)
+    # a view into the frame, not a copy
+    assert view.obj is frame
+
+
+@pytest.mark.asyncio
+async def test_dmx_input(capsys):
+    olad = OladStandin()
+    port = await olad.start()
+    client = OlaClient(port=port, min_backoff=0.01)
+    await client.connect()
+
+    fader = Channel()
+    speed = Channel(pos_max=1000)
+    desk = DmxInput()
+    desk.bind(0, fader)
+    desk.bind(3, speed)
+    changes: list = []
+    speed._patch_listener(changes.append)
+    assert await client.register_dmx(5, desk.on_dmx) is not None
+
+    assert olad.push_dmx(5, bytes([10, 0, 0, 255])) == 1
+    assert olad.push_dmx(4, bytes([99])) == 0
+    await asyncio.sleep(0.02)
+    # applied on tick, and every input frame acked
+    assert fader.value.pos == 0
+    desk.tick(1)
+    assert (fader.value.pos, speed.value.pos) == (10, 1000)
+    assert olad.acks == 1
+
+    # unchanged slots are not set again, short frames read as zero
+    olad.push_dmx(5, bytes([20, 1, 2, 255]))
+    olad.push_dmx(5, bytes([30]))
+    await asyncio.sleep(0.02)
+    desk.tick(2)
+    assert (fader.value.pos, speed.value.pos) == (30, 0)
+    assert len(changes) == 2
+    assert client.frames_received == 3
+
+    # registrations survive olad restarting
+    await olad.close()
+    await olad.start(port=port)
+    for _ in range(100):
+        if olad._registered.get(5):
+            break
+        await asyncio.sleep(0.01)
+    assert olad.push_dmx(5, bytes([40])) == 1
+
+    # a universe olad refuses is reported, and the rest still registered
+    await client.register_dmx(6, desk.on_dmx)
+    olad.fail.add("RegisterForDmx")
+    await olad.close()
+    await olad.start(port=port)
+    out = ""
+    for _ in range(100):
+        out += capsys.readouterr().out
+        if "universe 6" in out:
+            break
+        await asyncio.sleep(0.01)
+    assert "did not register universe 5 for input, RegisterForDmx failed" in out
+    assert "did not register universe 6 for input, RegisterForDmx failed" in out
+    olad.fail.clear()
+
+    await client.unregister_dmx(5, desk.on_dmx)
+    assert olad.push_dmx(5, bytes([50])) == 0
+    await client.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_readback_verifier():
+    olad = OladStandin()
+    port = await olad.start()
+    pool = OlaClientPool(port=port, connections=2)
+    await pool.connect()
+    verifier = ReadbackVerifier(pool, interval=0.01)
+
+    # nothing sent yet, then a frame still queued, neither is checked
+    assert await verifier.check(1) is None
+    frame = bytearray([1, 2, 3, 4])
+    await pool.set_dmx(1, frame)
+    await asyncio.sleep(0.01)
+    await pool.set_dmx(1, frame)
+    assert await verifier.check(1) is None
+    assert verifier.skipped == 1
+    await asyncio.sleep(0.01)
+
+    # compared with what was written, not the buffer as it is now
+    frame[0] = 9
+    assert await verifier.check(1) is True
+    assert 0 < verifier.latency == verifier.max_latency
+
+    # olad outputting something else
+    olad.dmx[1] = bytes([1, 2, 0, 4])
+    assert await verifier.check(1) is False
+    assert verifier.mismatched == {1: 2}
+    await pool.set_dmx(1, frame)
+    await asyncio.sleep(0.01)
+    assert await verifier.check(1) is True
+    assert verifier.mismatched == {}
+
+    # in the background once ticked, every universe sent
+    await pool.set_dmx(2, bytes([5]))
+    await asyncio.sleep(0.01)
+    verifier.tick(1)
+    await asyncio.sleep(0.05)
+    assert verifier.stats()["checks"] > 4
+    assert verifier.mismatches == 1
+
+    # olad losing a universe fails GetDmx, a mismatch rather than the end of
+    # the verifier
+    del olad.dmx[2]
+    checks = verifier.checks
+    await asyncio.sleep(0.05)
+    assert verifier._task is not None and not verifier._task.done()
+    assert verifier.checks > checks + 2
+    assert verifier.mismatched == {2: 0}
+    await verifier.close()
+    await pool.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_discovery(monkeypatch):
+    olad = OladStandin()
+    olad.plugins.append(PluginInfo(plugin_id=2, name="ArtNet"))
+    olad.devices = [
+        DeviceInfo(
+            device_alias=1,
+            plugin_id=1,
+            device_name="Dummy Device",
+            output_port=[PortInfo(port_id=0, universe=1, active=True)],
+            device_id="1-1",
+        ),
+        DeviceInfo(device_alias=2, plugin_id=2, device_name="ArtNet [eth0]"),
+    ]
+    olad.dmx[1] = b""
+    port = await olad.start()
+    client = OlaClient(port=port)
+    controller = Controller()
+    controller.add_network(client)
+    discovery = OlaDiscovery(client, controller.nodes, interval=0.01)
+    await client.connect()
+    events: list = []
+    for name in ["added", "changed", "removed"]:
+        getattr(controller.nodes, name).sub(
+            lambda node, name=name: events.append((name, node.name))
+        )
+
+    await discovery.discover()
+    nodes = {n.name: n for n in controller.nodes}
+    assert nodes["Dummy Device"].ports == ["out0:1 Universe 1"]
+    assert nodes["Dummy Device"].state == "Dummy"
+    assert nodes["ArtNet [eth0]"].state == "ArtNet"
+    assert events == [("added", "Dummy Device"), ("added", "ArtNet [eth0]")]
+    requests = olad.requests
+
+    # nothing changed, nothing notified, and plugins come from the cache
+    events.clear()
+    await discovery.discover()
+    assert events == []
+    assert olad.requests == requests + 2
+
+    # a device going, one being patched and one turning up
+    olad.devices[0].output_port[0].universe = 2
+    del olad.devices[1]
+    olad.devices.append(DeviceInfo(device_alias=3, plugin_id=3, device_name="New"))
+    olad.plugins.append(PluginInfo(plugin_id=3, name="E1.31"))
+    await discovery.discover()
+    assert sorted(events) == [
+        ("added", "New"),
+        ("changed", "Dummy Device"),
+        ("removed", "ArtNet [eth0]"),
+    ]
+    assert nodes["Dummy Device"].ports == ["out0:2"]
+    assert {n.name: n.state for n in controller.nodes}["New"] == "E1.31"
+
+    # polled in the background once ticked
+    rounds = discovery.rounds
+    discovery.tick(1)
+    await asyncio.sleep(0.05)
+    assert discovery.rounds > rounds
+
+    # failed requests skip a round rather than stop discovery
+    olad.fail.add("GetDeviceInfo")
+    await asyncio.sleep(0.02)
+    rounds = discovery.rounds
+    await asyncio.sleep(0.05)
+    assert discovery.rounds == rounds
+    assert discovery._error is not None and "RESPONSE_FAILED" in discovery._error
+    olad.fail.clear()
+    await asyncio.sleep(0.05)
+    assert discovery.rounds > rounds
+    assert discovery._error is None
+
+    # as does the connection going part way through a round
+    writer = client._writer
+    get_device_info = client.get_device_info
+
+    async def then_disconnect():
+        reply = await get_device_info()
+        client._writer = None
+        return reply
+
+    monkeypatch.setattr(client, "get_device_info", then_disconnect)
+    await asyncio.sleep(0.05)
+    assert discovery._task is not None and not discovery._task.done()
+    assert discovery._error is not None and "Stream not connected" in discovery._error
+    monkeypatch.undo()
+    client._writer = writer
+    await asyncio.sleep(0.05)
+    assert discovery._error is None
+    await discovery.close()
+    await client.close()
+    await olad.close()
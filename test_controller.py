@@ -2,7 +2,9 @@ from array import array
 import pytest
 
 from desk import Controller
+from fx import CosPulseEFX
 from registration import Fixture
+from tempo import TempoClock
 from trait import RGB, RGBA, RGBW, IndexedChannel, PTPos, IntensityChannel
 
 
@@ -293,3 +295,115 @@ def test_ptpos():
     p4.set_state(pt.get_state_as_dict())
     assert p4.get_state_as_dict() == {"pan": 38228, "tilt": 16383}
     assert p4.get_degrees_str() == " +45  -45"
+
+
+def test_tempo_clock():
+    tempo = TempoClock(bpm=120)
+    tempo.tick(10.0)
+    tempo.tick(10.25)
+    assert tempo.beats == pytest.approx(0.5)
+    assert tempo.beat_phase == pytest.approx(0.5)
+    tempo.tick(11.5)
+    assert tempo.beats == pytest.approx(3)
+    assert tempo.bar_phase == pytest.approx(0.75)
+
+    # tap at 100bpm, the last tap is on the beat
+    for t in [12.0, 12.6, 13.2, 13.8]:
+        tempo.tap_tempo(t)
+    assert tempo.get_bpm() == pytest.approx(100)
+    assert tempo.bpm.value.pos == 100
+    tempo.tick(13.8)
+    assert tempo.beat_phase == pytest.approx(0)
+
+    # a long pause starts a new measurement
+    tempo.tap_tempo(20.0)
+    assert tempo.get_bpm() == pytest.approx(100)
+    tempo.tap_tempo(20.5)
+    assert tempo.get_bpm() == pytest.approx(120)
+
+    # editing the bpm trait directly
+    tempo.bpm.set(90)
+    assert tempo.get_bpm() == 90
+
+
+@pytest.mark.asyncio
+async def test_efx_tempo_sync():
+    controller = Controller(update_interval=25)
+    controller.init = 0
+    cp = CosPulseEFX(channels=4)
+    controller.add_efx(cp)
+    assert cp.tempo is controller.tempo
+    cp.enabled.set(1)
+    cp.sync.set(1)
+    cp.speed.set(178)  # one channel per beat
+
+    controller.tempo.set_bpm(120)
+    await controller._tick_once(1.0)
+    await controller._tick_once(1.5)
+    # half a second at 120bpm is one beat
+    assert controller.tempo.beats == pytest.approx(1)
+    assert cp.o1.value.pos == 255
+
+
+class MockHeadFixture(Fixture):
+    def __init__(self):
+        self.pos = PTPos()
+        self.gobo = IndexedChannel(values={"open": 0, "star": 20, "rings": 40})
+        super().__init__()
+
+    def patch(self, universe, base, data):
+        self.pos.patch(data, base)
+        self.gobo.patch(data, base + 4)
+        super().patch(universe, base, data)
+
+
+@pytest.mark.asyncio
+async def test_preset_fade():
+    controller = Controller(update_interval=25)
+    controller.init = 0
+    controller.add_fixture(f := MockRGBFixture())
+    controller.add_fixture(h := MockHeadFixture(), universe=1, base=10)
+
+    controller.save_preset("dark")
+    f.wash.set_rgb(200, 100, 0)
+    h.pos.set_pos(0xFFFF, 0x1000)
+    h.gobo.set("rings")
+    controller.save_preset("bright")
+    controller.load_preset("dark")
+    assert f.wash.get_approx_rgb() == (0, 0, 0)
+
+    await controller._tick_once(10)
+    controller.load_preset("bright", fade=2, snap_at=0.75)
+    await controller._tick_once(11)
+    assert f.wash.get_approx_rgb() == (100, 50, 0)
+    # 16-bit values fade with full resolution
+    assert h.pos.pan.pos == 0x7FFF
+    assert controller.get_dmx(1, 10) == 0x7F
+    assert controller.get_dmx(1, 11) == 0xFF
+    assert h.gobo.get() == "open"
+
+    await controller._tick_once(11.5)
+    assert h.gobo.get() == "rings"
+    await controller._tick_once(12)
+    assert f.wash.get_approx_rgb() == (200, 100, 0)
+    assert h.pos.get_state_as_dict() == {"pan": 0xFFFF, "tilt": 0x1000}
+
+    # easing changes the shape but not the end points
+    controller.load_preset("dark", fade=2, easing="in")
+    await controller._tick_once(13)
+    assert f.wash.get_approx_rgb() == (150, 75, 0)
+    await controller._tick_once(14)
+    assert f.wash.get_approx_rgb() == (0, 0, 0)
+
+    # an instant load cancels a fade in progress
+    controller.load_preset("bright", fade=2)
+    controller.load_preset("dark")
+    await controller._tick_once(15)
+    assert f.wash.get_approx_rgb() == (0, 0, 0)
+
+    # adding an EFX part way through renumbers the channels, the fade carries on
+    controller.load_preset("bright", fade=2)
+    await controller._tick_once(16)
+    controller.add_efx(CosPulseEFX())
+    await controller._tick_once(17)
+    assert f.wash.get_approx_rgb() == (200, 100, 0)
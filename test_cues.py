@@ -0,0 +1,162 @@
+from array import array
+
+from cues import Cue, CueStack, TrackingCueList
+from desk import Controller
+from playback import PresetCrossfader
+from test_controller import MockHeadFixture, MockRGBFixture
+
+
+def make_controller():
+    controller = Controller(update_interval=25)
+    controller.add_fixture(f := MockRGBFixture())
+    return controller, f
+
+
+def rgb(r, g, b):
+    return {"MockRGBFixture-0": {"wash": {"red": r, "green": g, "blue": b}}}
+
+
+def test_cue_fades():
+    controller, f = make_controller()
+    stack = CueStack(
+        controller,
+        [
+            Cue(rgb(0, 0, 0)),
+            Cue(rgb(200, 100, 0), fade_in=2, fade_out=1),
+            Cue(rgb(0, 100, 50), fade_in=1, delay=1),
+        ],
+    )
+    assert stack.go(0) == 0
+    assert f.wash.get_approx_rgb() == (0, 0, 0)
+
+    assert stack.go(10) == 1
+    stack.tick(11)
+    assert f.wash.get_approx_rgb() == (100, 50, 0)
+    stack.tick(12)
+    assert f.wash.get_approx_rgb() == (200, 100, 0)
+
+    # red fades out on the fade_in time of cue 2, after its delay
+    stack.go(20)
+    stack.tick(20.5)
+    assert f.wash.get_approx_rgb() == (200, 100, 0)
+    stack.tick(21.5)
+    assert f.wash.get_approx_rgb() == (100, 100, 25)
+    stack.tick(22)
+    assert f.wash.get_approx_rgb() == (0, 100, 50)
+
+    # end of the stack
+    assert stack.go(30) is None
+
+    # a fixture added part way through a fade, then cued, leaves the fade running
+    stack.goto(1, 40)
+    stack.tick(41)
+    controller.add_fixture(h := MockHeadFixture())
+    stack.add_cue(Cue({"MockHeadFixture-0": {"pos": {"pan": 100}}}))
+    stack.goto(3, 41)
+    stack.tick(42)
+    assert f.wash.get_approx_rgb() == (200, 100, 0)
+    assert h.pos.pan.pos == 100
+
+
+def test_cue_follow_and_presets():
+    controller, f = make_controller()
+    f.wash.set_rgb(10, 20, 30)
+    controller.save_preset("a")
+    f.wash.set_rgb(0, 0, 0)
+
+    stack = CueStack(controller, [Cue("a", follow=0.5), Cue(rgb(1, 2, 3))])
+    stack.go(0)
+    assert f.wash.get_approx_rgb() == (10, 20, 30)
+    stack.tick(0.25)
+    assert stack.current == 0
+    stack.tick(0.5)
+    assert stack.current == 1
+    assert f.wash.get_approx_rgb() == (1, 2, 3)
+
+    # adding a fixture renumbers channels, cues recompile on the next go
+    controller.add_fixture(MockRGBFixture())
+    stack.goto(0, 1.0)
+    assert f.wash.get_approx_rgb() == (10, 20, 30)
+
+    # as does saving over a preset a cue names
+    f.wash.set_rgb(40, 50, 60)
+    controller.save_preset("a")
+    stack.goto(1, 2.0)
+    stack.goto(0, 3.0)
+    assert f.wash.get_approx_rgb() == (40, 50, 60)
+
+
+def test_tracking_cue_list():
+    controller, f = make_controller()
+    tcl = TrackingCueList(controller, checkpoint_every=8)
+    # each cue moves one channel, the others track through
+    for n in range(100):
+        ch = ["red", "green", "blue"][n % 3]
+        tcl.add_cue(Cue({"MockRGBFixture-0": {"wash": {ch: n}}}))
+    assert len(tcl) == 100
+    assert len(tcl._checkpoints) == 13
+
+    tcl.goto(77, 0)
+    # 77 % 3 == 2 (blue), 76 % 3 == 1 (green), 75 % 3 == 0 (red)
+    assert f.wash.get_approx_rgb() == (75, 76, 77)
+    assert tcl.current == 77
+
+    # GO only moves the delta of the next cue
+    f.wash.set_green(5)
+    tcl.go(1)
+    assert f.wash.get_approx_rgb() == (78, 5, 77)
+
+    # first cue only knows about red
+    assert tcl.tracked_state(0) == (array("I", [0]), array("i", [0]))
+
+
+def test_tracking_record():
+    controller, f = make_controller()
+    tcl = TrackingCueList(controller)
+    f.wash.set_rgb(10, 20, 30)
+    tcl.record()
+    f.wash.set_rgb(10, 50, 30)
+    tcl.record(fade_in=2)
+    assert tcl.cues[1].state == {"MockRGBFixture-0": {"wash": {"green": 50}}}
+    assert tcl.cues[1].fade_in == 2
+
+    f.wash.set_rgb(0, 0, 0)
+    # a jump fades everything tracked so far on the timing of the target cue
+    tcl.goto(1, 0)
+    tcl.tick(1)
+    assert f.wash.get_approx_rgb() == (5, 25, 15)
+    tcl.tick(2)
+    assert f.wash.get_approx_rgb() == (10, 50, 30)
+
+
+def test_preset_crossfader():
+    controller, f = make_controller()
+    controller.add_fixture(h := MockHeadFixture())
+    f.wash.set_rgb(200, 0, 0)
+    h.gobo.set("star")
+    controller.save_preset("a")
+    f.wash.set_rgb(0, 100, 0)
+    h.gobo.set("rings")
+    controller.save_preset("b")
+
+    xf = PresetCrossfader(controller, "a", "b")
+    controller.add_efx(xf)
+    xf.set_fraction(0)
+    assert f.wash.get_approx_rgb() == (200, 0, 0)
+    assert h.gobo.get() == "star"
+
+    xf.set_fraction(0.25)
+    assert f.wash.get_approx_rgb() == (150, 25, 0)
+    assert h.gobo.get() == "star"
+    xf.set_midi(127)
+    assert f.wash.get_approx_rgb() == (0, 100, 0)
+    assert h.gobo.get() == "rings"
+
+    # the fader is not part of the looks it blends
+    assert controller.get_state_as_dict()[xf.name] == {"fader": {}}
+
+    # saving over a preset is picked up on the next move
+    f.wash.set_rgb(0, 0, 50)
+    controller.save_preset("b")
+    xf.set_fraction(0.5)
+    assert f.wash.get_approx_rgb() == (100, 0, 25)
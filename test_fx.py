@@ -1,6 +1,18 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pytest
 
-from fx import perlin, ColourInterpolateEFX, CosPulseEFX, ChangeInBlack, PositionIndexer
+from fx import (
+    perlin,
+    ColourInterpolateEFX,
+    CosPulseEFX,
+    ChangeInBlack,
+    PositionIndexer,
+    TrackingEFX,
+    ExpressionEFX,
+    PerlinFieldEFX,
+)
+from geometry import Placement, nearest_pan_tilt
 from trait import IndexedChannel
 
 
@@ -130,15 +142,13 @@ def test_position_index():
     assert pi.c0.get_degrees_str() == "  -0   -0"
     assert pi.o0.get_degrees_str() == "  -0   -0"
 
-    print(id(pi.data[0][0]))
-    print(id(pi.data[0][1]))
-
     assert pi.get_state_as_dict() == {
         "c0": {},
         "i0": {"value": 0},
         "o0": {"pan": 32767, "tilt": 32767},
         "preset": {"value": 0},
         "width": {"value": 0},
+        "angle": {"value": 45},
     }
     pi.preset.set(1)
     assert pi.get_global_as_dict() == {
@@ -152,6 +162,7 @@ def test_position_index():
         "o0": {"pan": 0, "tilt": 0},
         "preset": {"value": 1},
         "width": {"value": 0},
+        "angle": {"value": 45},
     }
     # change preset 1 values by control input
     pi.c0.set_degrees_pos(15, -15)
@@ -170,8 +181,172 @@ def test_position_index():
         "o0": {"pan": 32767, "tilt": 32767},
         "preset": {"value": 0},
         "width": {"value": 0},
+        "angle": {"value": 45},
     }
     assert pi.get_global_as_dict() == {
         "data-0-0": {"pan": 32767, "tilt": 32767},
         "data-0-1": {"pan": 34587, "tilt": 27306},
     }
+
+
+def test_position_index_spread():
+    pi = PositionIndexer(channels=3, presets=2)
+    notified = []
+    pi.o1._patch_listener(notified.append)
+    for ch, c in enumerate(pi.controlpts):
+        c.set_degrees_pos(10 * ch, 0)
+    pi.i0.set(0)
+    pi.i2.set(255)
+    notified.clear()
+
+    # by default the spread moves pan and tilt together, as it did before angle
+    pi.width.set(90)
+    assert pi._outputs[0].get_degrees_str() == " -45  -45"
+    assert pi._outputs[2].get_degrees_str() == " +65  +45"
+    notified.clear()
+
+    # spread along pan, first head at -45 degrees and last at +45
+    pi.angle.set(0)
+    assert pi.o0.get_degrees_str() == " -45   -0"
+    assert pi.o2.get_degrees_str() == " +65   -0"
+    # i1 at 0 is also at the edge of the spread
+    assert pi.o1.get_degrees_str() == " -35   -0"
+    assert len(notified) == 1
+
+    # turning the spread to tilt moves every output once
+    pi.angle.set(90)
+    assert pi.o0.get_degrees_str() == "  -0  -45"
+    assert pi.o2.get_degrees_str() == " +20  +45"
+    assert len(notified) == 2
+
+    # switching preset recomputes all outputs from the stored home positions
+    pi.preset.set(1)
+    # unset presets are at raw 0, the very end of travel
+    assert pi.o2.get_degrees_str() == "-270  -45"
+    assert len(notified) == 3
+
+
+def test_nearest_pan_tilt():
+    # straight ahead, no wrapping needed
+    assert nearest_pan_tilt(90, 45, 0, 540, 180) == (90, 45)
+    # near the +270 end of travel, -90 is reached by going on to +270
+    assert nearest_pan_tilt(-90, 45, 250, 540, 180) == (270, 45)
+    # flipping the tilt is a shorter move than panning half a turn
+    assert nearest_pan_tilt(180, 30, 0, 540, 180) == (0, -30)
+    # cannot tilt above the horizon of the head
+    assert nearest_pan_tilt(0, 120, 0, 540, 180) == (0, 90)
+
+
+def test_tracking():
+    hung = Placement(0, 0, 5)
+    floor = Placement(4, 0, 0, roll=180)
+    t = TrackingEFX(placements=[hung, floor])
+    t.enabled.set(1)
+
+    # point at the floor directly below the hung head
+    t.set_target(0, 0, 0)
+    t.tick(0)
+    assert t.o0.get_degrees_str() == "  -0   -0"
+    assert t.o1.get_degrees_str() == "  -0  -90"
+
+    # 5m downstage of hung head at floor level is 45 degrees tilt
+    t.set_target(5, 0, 0)
+    t.tick(1)
+    assert t.o0.get_degrees_str() == "  -0  +45"
+
+    # 5m in y is the same tilt but panned a quarter turn
+    t.set_target(0, 5, 0)
+    t.tick(2)
+    assert t.o0.get_degrees_str() == " +90  +45"
+
+    # no recalculation unless the target moves
+    t.o0.set_degrees_pos(0, 0)
+    t.tick(3)
+    assert t.o0.get_degrees_str() == "  -0   -0"
+
+    # targets on the negative side of the origin, 5m the other way is the same
+    # tilt panned half a turn, and (-3, -2) is not clamped to straight down
+    t.set_target(-5, 0, 0)
+    t.tick(4)
+    assert t._outputs[0].get_degrees_str() == "+180  +45"
+    t.set_target(-3, -2, 0)
+    t.tick(5)
+    assert (t.x.value.pos, t.y.value.pos) == (700, 800)
+    assert t._outputs[0].get_degrees_str() == "+214  +36"
+
+
+def test_expression_efx():
+    e = ExpressionEFX("i / (n - 1)", channels=3)
+    e.enabled.set(1)
+    e.tick(0)
+    assert [o.value.pos for o in e._outputs] == [0, 127, 255]
+
+    # values are clamped to 0-1
+    e.set_expression("sin(t * pi / 2 + i * pi / 2) + a")
+    e.tick(1)
+    assert [o.value.pos for o in e._outputs] == [255, 0, 0]
+    e.a.set(255)
+    e.tick(1)
+    assert [o.value.pos for o in e._outputs] == [255, 255, 0]
+
+    # bad expressions are rejected and the last one keeps running
+    for bad in ["__import__('os')", "t.real", "[1]", "open", "i +", "1 << 99"]:
+        with pytest.raises((ValueError, SyntaxError)):
+            e.set_expression(bad)
+    for bad in ["sin()", "sin(t, a)", "min(1)"]:
+        with pytest.raises(TypeError):
+            e.set_expression(bad)
+    assert e.expression == "sin(t * pi / 2 + i * pi / 2) + a"
+
+    # only undefined at t = 0, those ticks are skipped
+    e.set_expression("log(t)")
+    e.set_expression("1 / t")
+    e.tick(0)
+    assert [o.value.pos for o in e._outputs] == [255, 255, 0]
+    e.tick(2)
+    assert [o.value.pos for o in e._outputs] == [127, 127, 127]
+
+    # powers are floats, so a huge one overflows rather than hanging
+    e.set_expression("9 ** 9 ** 9 ** 9")
+    e.set_expression("2 ** (i - 1)")
+    e.tick(2)
+    assert [o.value.pos for o in e._outputs] == [127, 255, 255]
+    assert e.get_global_as_dict()["expression"] == e.expression
+
+    # fixture placement is available as x, y, z
+    p = ExpressionEFX(
+        "z / 10", channels=2, placements=[Placement(0, 0, 5), Placement(1, 0, 10)]
+    )
+    p.enabled.set(1)
+    p.tick(0)
+    assert p.o0.value.pos == 127
+    assert p.o1.value.pos == 255
+
+
+def test_background_efx():
+    field = PerlinFieldEFX(width=4, height=2)
+    field.enabled.set(1)
+    field.speed.set(100)
+    field.tick(0.5)
+    # nothing applied until a later tick finds the result finished
+    assert [o.value.pos for o in field._outputs] == [0] * 8
+    field.wait()
+    field.tick(0.6)
+    expected = PerlinFieldEFX.compute((4, 2, 4.0, field._trunc, 0.5))
+    assert [o.value.pos for o in field._outputs] == expected
+    assert len(set(expected)) > 1
+    field.wait()
+    # computed in another process unless given an executor
+    assert isinstance(field._get_executor(), ProcessPoolExecutor)
+
+    class Broken(PerlinFieldEFX):
+        @staticmethod
+        def compute(snapshot):
+            raise ValueError("bad")
+
+    b = Broken(executor=ThreadPoolExecutor())
+    b.enabled.set(1)
+    b.tick(0)
+    b.wait()
+    b.tick(1)
+    assert isinstance(b.error, ValueError)
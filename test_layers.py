@@ -0,0 +1,89 @@
+import pytest
+
+from desk import Controller
+from fx import StaticColour
+from layers import LayerStack
+from trait import RGB, RGBW, IntensityChannel
+
+
+def test_blend_modes():
+    target = IntensityChannel()
+    stack = LayerStack(target)
+    base = stack.add_layer(priority=0)
+    top = stack.add_layer(priority=1, mode="add", opacity=0.5)
+    base.trait.set(100)
+    top.trait.set(100)
+    stack.composite()
+    assert target.value.pos == 150
+
+    # multiply by black at half opacity halves the layers below
+    top.mode = "multiply"
+    top.trait.set(0)
+    stack.composite()
+    assert target.value.pos == 50
+
+    top.mode = "max"
+    top.trait.set(250)
+    stack.composite()
+    assert target.value.pos == 125
+
+    top.mode = "replace"
+    top.opacity = 1.0
+    stack.composite()
+    assert target.value.pos == 250
+
+    # priority, not the order added, decides what is on top
+    top.set_priority(-1)
+    stack.composite()
+    assert target.value.pos == 100
+
+    top.enabled = False
+    base.enabled = False
+    stack.composite()
+    assert target.value.pos == 0
+
+    with pytest.raises(ValueError):
+        stack.add_layer(mode="screen")
+
+
+def test_layers_are_deterministic():
+    # two EFX driving the same trait composite the same way whatever order
+    # they tick in
+    controller = Controller(update_interval=25)
+    wash = RGBW()
+    stack = controller.add_layer_stack(wash)
+
+    red = StaticColour()
+    blue = StaticColour()
+    red.c0.bind(stack.add_layer(priority=1, mode="add").trait)
+    blue.c0.bind(stack.add_layer(priority=0).trait)
+    red.c0.set_rgb(255, 0, 0)
+    blue.c0.set_rgb(0, 0, 255)
+    assert isinstance(stack.layers[0].trait, RGBW)
+
+    for efx in [red, blue]:
+        efx.enabled.set(1)
+        controller.add_efx(efx)
+    for efx in [blue, red]:
+        efx.tick(0)
+    stack.composite()
+    assert wash.get_hex() == "#FF00FF"
+
+    controller.efx.reverse()
+    for efx in controller.efx:
+        efx.tick(1)
+    stack.composite()
+    assert wash.get_hex() == "#FF00FF"
+    assert wash.white.pos == 0
+
+
+def test_layer_partial_channels():
+    # an RGB layer on an RGBW target leaves white transparent
+    wash = RGBW()
+    stack = LayerStack(wash)
+    layer = stack.add_layer()
+    rgb = RGB()
+    rgb.bind(layer.trait)
+    rgb.set_rgb(1, 2, 3)
+    stack.composite()
+    assert wash.get_approx_rgb() == (1, 2, 3)
@@ -0,0 +1,88 @@
+import pytest
+
+from fx import PerlinNoiseEFX, PositionIndexer
+from modulation import LFO, Envelope, ModulationMatrix
+from tempo import TempoClock
+
+
+def test_lfo_shapes():
+    assert LFO(rate=1).value(0.25, 0) == pytest.approx(1)
+    assert LFO(rate=1, shape="triangle").value(0.5, 0) == 1
+    assert LFO(rate=1, shape="square").value(0.75, 0) == -1
+    assert LFO(rate=1, shape="saw").value(0.75, 0) == 0.5
+    # synced to the beat ignores showtime
+    assert LFO(beats=4).value(99, 1) == pytest.approx(1)
+    with pytest.raises(ValueError):
+        LFO(shape="wobble")
+
+
+def test_envelope():
+    env = Envelope(attack=1, decay=1, sustain=0.5, release=2)
+    assert env.value(0, 0) == 0
+    env.trigger()
+    assert env.value(10, 0) == 0
+    assert env.value(10.5, 0) == 0.5
+    assert env.value(11.5, 0) == 0.75
+    assert env.value(15, 0) == 0.5
+    env.release()
+    assert env.value(16, 0) == 0.5
+    assert env.value(17, 0) == 0.25
+    assert env.value(18, 0) == 0
+
+
+def test_matrix_routes():
+    tempo = TempoClock(bpm=60)
+    matrix = ModulationMatrix(tempo)
+    perlin = PerlinNoiseEFX()
+    perlin.speed.set(100)
+    notified = []
+    perlin.speed._patch_listener(notified.append)
+
+    lfo = LFO(beats=4, shape="triangle")
+    matrix.route(lfo, perlin.speed, depth=0.1)
+    matrix.route(LFO(rate=1, shape="square"), perlin.speed, depth=0.02)
+
+    tempo.tick(0)
+    matrix.tick(0)
+    # triangle starts at -1, square at +1
+    assert perlin.speed.value.pos == 80  # 100 - 25.5 + 5.1
+    tempo.tick(2)
+    matrix.tick(2)
+    assert perlin.speed.value.pos == 131  # 100 + 25.5 + 5.1
+    # listeners are left alone unless asked for
+    assert notified == []
+
+    # moving the parameter by hand re-bases the modulation
+    perlin.speed.set(200)
+    tempo.tick(4)
+    matrix.tick(4)
+    assert perlin.speed.value.pos == 180
+    # presets get the base rather than the modulated value
+    assert perlin.speed.get_state_as_dict() == {"value": 200}
+
+    # even when set to the value the modulation had written
+    perlin.speed.set(180)
+    tempo.tick(8)
+    matrix.tick(8)
+    assert perlin.speed.value.pos == 160
+    assert perlin.speed.get_state_as_dict() == {"value": 180}
+
+
+def test_matrix_notify():
+    matrix = ModulationMatrix()
+    pi = PositionIndexer()
+    pi.width.set(90)
+    notified = []
+    pi.width._patch_listener(notified.append)
+    env = Envelope(attack=1, decay=0, sustain=1, release=1)
+    route = matrix.route(env, pi.width, depth=0.25, notify=True)
+    matrix.tick(0)
+    assert notified == []
+    env.trigger()
+    matrix.tick(1)
+    matrix.tick(1.5)
+    assert pi.width.value.pos == 113  # half way up the attack
+    matrix.set_depth(route, 0)
+    matrix.tick(2)
+    assert pi.width.value.pos == 90
+    assert len(notified) == 2
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from aio_ola import OlaClient, OlaRpcError
+from ola.proto import DmxData
+from olad_standin import OladStandin
+
+
+@pytest.mark.asyncio
+async def test_standin_rpcs():
+    olad = OladStandin(tag=2)
+    port = await olad.start()
+    client = OlaClient(port=port)
+    await client.connect()
+
+    await client.set_dmx(1, bytes([1, 2, 3]))
+    await client.set_dmx(3, bytes([4, 5]))
+    await asyncio.sleep(0.02)
+    assert olad.dmx == {1: bytes([1, 2, 3]), 3: bytes([4, 5])}
+    assert [stamp for _, stamp in olad.arrivals[1]] == [bytes([1, 2])]
+
+    # read back what was streamed
+    assert await client.get_dmx(1) == DmxData(universe=1, data=bytes([1, 2, 3]))
+    # olad fails requests for universes it does not have
+    with pytest.raises(OlaRpcError, match="RESPONSE_FAILED: Universe doesn't exist"):
+        await client.get_dmx(2)
+    universes = await client.get_universes()
+    assert [u.universe for u in universes.universe] == [1, 3]
+    plugins = await client.get_plugin_list()
+    assert [p.name for p in plugins.plugin] == ["Dummy"]
+    assert olad.requests == 4
+
+    await client.close()
+    await olad.close()
+
+
+@pytest.mark.asyncio
+async def test_standin_ack_delay():
+    olad = OladStandin(ack_delay=0.02, jitter=0.01)
+    port = await olad.start()
+    client = OlaClient(port=port, streaming=False)
+    await client.connect()
+
+    await asyncio.gather(*(client.set_dmx(u, bytes([u])) for u in range(1, 9)))
+    assert client.completed == 8
+    assert 0.02 <= client.rtt < 0.1
+    # arrivals are recorded as frames come in, not when acked
+    times = [t for u in range(1, 9) for t, _ in olad.arrivals[u]]
+    assert max(times) - min(times) < 0.02
+
+    await client.close()
+    await olad.close()
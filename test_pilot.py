@@ -0,0 +1,38 @@
+import pytest
+from textual.app import App
+from textual.widgets import Input, Label
+
+from fx import ExpressionEFX
+from pilot import AddExpressionScreen
+
+
+class ExpressionApp(App):
+    def __init__(self):
+        super().__init__()
+        self.added = []
+
+    def on_mount(self) -> None:
+        self.push_screen(AddExpressionScreen(), self.added.append)
+
+
+@pytest.mark.asyncio
+async def test_add_expression_errors():
+    app = ExpressionApp()
+    async with app.run_test() as pilot:
+        screen = app.screen
+        assert isinstance(screen, AddExpressionScreen)
+        # compiles, but fails calling sin with no arguments
+        for bad in ["sin()", "clamp(t, 1, 2, 3)", "i +"]:
+            screen.query_one("#expression", Input).value = bad
+            await pilot.click("#add")
+            assert str(screen.query_one("#error", Label).renderable)
+            assert app.screen is screen
+        assert app.added == []
+
+        screen.query_one("#expression", Input).value = "log(t)"
+        await pilot.click("#add")
+        await pilot.pause()
+        assert app.screen is not screen
+        [efx] = app.added
+        assert isinstance(efx, ExpressionEFX)
+        assert efx.expression == "log(t)"
@@ -0,0 +1,69 @@
+import io
+import os
+import threading
+from array import array
+
+import pytest
+
+from sound import AudioAnalyser, PcmSource, SoundToLight, WavSource, open_audio
+
+KICK_WAV = os.path.join(os.path.dirname(__file__), "tests", "kick-120bpm.wav")
+
+
+def test_pcm_source_mixdown():
+    pcm = array("h", [32767, -32767, 16384, 16384, 0, 0])
+    src = PcmSource(io.BytesIO(pcm.tobytes()), samplerate=8000, channels=2)
+    assert src.read(2) == [0, pytest.approx(0.5)]
+    # odd trailing samples are dropped rather than misaligned
+    assert src.read(2) == [0]
+    assert src.read(2) == []
+
+
+def test_open_audio_pipe(tmp_path):
+    fifo = tmp_path / "pcm"
+    os.mkfifo(fifo)
+    pcm = array("h", [16384, -16384])
+    writer = threading.Thread(target=fifo.write_bytes, args=(pcm.tobytes(),))
+    writer.start()
+    src = open_audio(str(fifo))
+    assert src.read(4) == [0.5, -0.5]
+    writer.join()
+    assert src.read(4) == []
+    src.close()
+    wav = open_audio(KICK_WAV)
+    assert isinstance(wav, WavSource)
+    wav.close()
+
+
+def test_analyser_beats():
+    src = WavSource(KICK_WAV)
+    analyser = AudioAnalyser(src.samplerate, block=512, bands=4)
+    beats = []
+    bands = [0.0] * 4
+    while samples := src.read(512):
+        result = analyser.process(samples)
+        if result.beat:
+            beats.append(result.time)
+        bands = [a + b for a, b in zip(bands, result.bands)]
+
+    # one kick every half second, starting 50ms in
+    assert len(beats) == 8
+    assert beats[0] == pytest.approx(0.05, abs=0.05)
+    assert analyser.bpm() == pytest.approx(120, abs=5)
+    # a 60Hz kick lives in the lowest band
+    assert bands[0] == max(bands)
+
+
+def test_sound_to_light_worker():
+    s2l = SoundToLight(WavSource(KICK_WAV), bands=4, realtime=False)
+    s2l.tick(0)
+    assert s2l.b0.value.pos == 0
+
+    s2l.start()
+    s2l.join(timeout=10)
+    s2l.tick(1)
+    # the beat pulses for the one tick following detection
+    assert s2l.beat.value.pos == 255
+    assert s2l.bpm.value.pos == pytest.approx(120, abs=5)
+    s2l.tick(2)
+    assert s2l.beat.value.pos == 0
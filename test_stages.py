@@ -0,0 +1,143 @@
+import pytest
+
+from desk import Controller, ControllerUniverseOutput
+from fixtures import IbizaMini
+from fx import StaticCopy
+from stages import MoveInBlack, SlewLimiter, Strobe
+from test_controller import MockHeadFixture, MockRGBFixture
+from trait import IntensityChannel
+
+
+class RecordingClient(ControllerUniverseOutput):
+    def __init__(self):
+        self.sent = {}
+
+    async def set_dmx(self, universe, data):
+        self.sent[universe] = bytes(data)
+
+
+@pytest.mark.asyncio
+async def test_slew_limiter():
+    controller = Controller(update_interval=25)
+    controller.init = 0
+    controller.add_network(client := RecordingClient())
+    controller.add_fixture(h := MockHeadFixture(), universe=1, base=10)
+    controller.add_fixture(f := MockRGBFixture(), universe=1, base=1)
+    slew = controller.add_output_stage(SlewLimiter())
+    slew.add_fixture(h, rate=0.25)
+    slew.add(f.wash, tau=1.0)
+
+    await controller._tick_once(10)
+    assert client.sent[1][10:12] == bytes([0, 0])
+
+    h.pos.set_pos(0xFFFF, 0)
+    h.gobo.set("rings")
+    f.wash.set_rgb(200, 0, 0)
+    await controller._tick_once(11)
+    # a quarter of the way in a second, full 16-bit resolution
+    assert client.sent[1][10:12] == bytes([0x40, 0x00])
+    # indexed channels are not slewed
+    assert client.sent[1][14] == 40
+    # one time constant
+    assert client.sent[1][1] == round(200 * (1 - 1 / 2.718281828))
+    # the universe keeps the value asked for
+    assert controller.get_dmx(1, 10) == 0xFF
+    assert controller.get_dmx(1, 1) == 200
+
+    await controller._tick_once(15)
+    assert client.sent[1][10:12] == bytes([0xFF, 0xFF])
+
+    # patching something new keeps channels already moving where they are
+    h.pos.set_pos(0, 0)
+    controller.add_fixture(MockRGBFixture(), universe=1, base=30)
+    await controller._tick_once(16)
+    assert client.sent[1][10:12] == bytes([0xBF, 0xFF])
+
+
+async def run_strobe(strobe, frames, jitter=0.0):
+    controller = Controller(update_interval=25)
+    controller.init = 0
+    controller.clock = lambda: 0
+    controller.add_network(client := RecordingClient())
+    dimmer = IntensityChannel()
+    dimmer.patch(controller._get_universe(1), 0)
+    dimmer.set(255)
+    controller.add_output_stage(strobe)
+    strobe.add(dimmer)
+    strobe.set_enabled(True)
+    lit = []
+    for n in range(frames):
+        await controller._tick_once(1 + n * 0.025 + jitter * (n % 2))
+        lit.append(client.sent[1][0] == 255)
+    assert dimmer.value.pos == 255
+    return lit
+
+
+def edges(lit):
+    return [n for n in range(1, len(lit)) if lit[n] and not lit[n - 1]]
+
+
+@pytest.mark.asyncio
+async def test_strobe_quantize():
+    # 40fps / 7Hz rounds to a flash every 6 frames, 3 lit
+    lit = await run_strobe(Strobe(rate=7, mode="quantize"), 24)
+    assert lit[:12] == [True] * 3 + [False] * 3 + [True] * 3 + [False] * 3
+    assert edges(lit) == [6, 12, 18]
+
+
+@pytest.mark.asyncio
+async def test_strobe_dither():
+    # 40fps / 7Hz is 5.71 frames, edges are 5 or 6 frames apart but keep the rate
+    lit = await run_strobe(Strobe(rate=7, mode="dither"), 80, jitter=0.004)
+    e = edges(lit)
+    assert set(b - a for a, b in zip(e, e[1:])) == {5, 6}
+    assert len(e) == 13
+    assert e[-1] == pytest.approx(13 * 40 / 7, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_move_in_black():
+    controller = Controller(update_interval=25)
+    controller.init = 0
+    controller.clock = lambda: 0
+    controller.add_network(client := RecordingClient())
+    controller.add_output_stage(mib := MoveInBlack())
+    controller.add_fixture(a := IbizaMini(), universe=1, base=0)
+    controller.add_fixture(b := IbizaMini(), universe=1, base=20)
+    b.wheel_travel = 1.0
+    a.spot.set(200)
+    b.spot.set(100)
+    await controller._tick_once(10)
+    assert client.sent[1][6] == 200
+
+    a.spot_gobo.set("rings")
+    b.spot_cw.set("red")
+    await controller._tick_once(11)
+    # only the spot of the fixture whose wheel moved goes dark
+    assert client.sent[1][6] == 0
+    assert client.sent[1][26] == 0
+    assert client.sent[1][8] == 90
+    assert controller.get_dmx(1, 6) == 200
+    assert set(mib.blanked()) == {a, b}
+
+    await controller._tick_once(11.5)
+    assert client.sent[1][6] == 200
+    assert client.sent[1][26] == 0
+
+    # a change part way through starts the travel time again
+    b.spot_gobo.set("donut")
+    await controller._tick_once(12)
+    assert client.sent[1][26] == 0
+    await controller._tick_once(12.6)
+    assert client.sent[1][26] == 0
+    await controller._tick_once(13)
+    assert client.sent[1][26] == 100
+    assert mib.blanked() == []
+
+    # wheels driven through a binding, as vh.py does, blank the same
+    cw = StaticCopy(of_trait=a.spot_cw)
+    cw.c0.bind(a.spot_cw)
+    cw.c0.set("red")
+    await controller._tick_once(14)
+    assert client.sent[1][6] == 0
+    assert mib.blanked() == [a]
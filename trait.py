@@ -180,6 +180,9 @@ class RGBW(RGB):
             return True
         return False
 
+    def duplicate(self):
+        return RGBW()
+
     def get_approx_rgb(self):
         r, g, b = super().get_approx_rgb()
         w = self.white.pos
@@ -206,6 +209,9 @@ class RGBA(RGB):
         super().patch(data, base)
         self.amber.patch(data, base + 3)
 
+    def duplicate(self):
+        return RGBA()
+
     def get_approx_rgb(self):
         r, g, b = super().get_approx_rgb()
         a = self.amber.pos
@@ -320,7 +326,7 @@ class IntensityChannel(Channel):
 
 class DegreesChannel(Channel):
     def __init__(self, value=0, pos_max=180):
-        super().__init__(pos_max=pos_max)
+        super().__init__(value=value, pos_max=pos_max)
 
 
 class IntChannel(Channel):
@@ -343,8 +349,9 @@ class IndexedChannel(Trait):
     def patch(self, data: UniverseType, base: int) -> None:
         self.value.patch(data, base)
 
-    def _copy_to(self, other: "Channel", src: Any):
-        other.value.set(self.value.pos)
+    def _copy_to(self, other: "IndexedChannel", src: Any):
+        # notifies, so listeners see a bound wheel move, eg. stages.MoveInBlack
+        other.set_single(other.value, self.value.pos)
 
     def bind(self, other: Trait):
         if not isinstance(other, IndexedChannel):
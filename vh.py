@@ -8,12 +8,13 @@ from fx import (
     StaticColour,
     CosPulseEFX,
     StaticCopy,
-    ChangeInBlack,
     PositionIndexer,
 )
+from sound import SoundToLight, open_audio
+from stages import MoveInBlack
 from trait import IntensityChannel
 from pilot import TextualPilot
-from aio_ola import OlaClient
+from aio_ola import OlaClient, OlaClientPool, OlaDiscovery, ReadbackVerifier
 from aioartnet import ArtNetClient
 from rtmidi.midiutil import open_midiinput
 from typing import Optional
@@ -23,6 +24,8 @@ def build_show(args) -> Controller:
     client: Optional[ControllerUniverseOutput] = None
     if args.output == "ola":
         client = OlaClient()
+    elif args.output == "ola-pool":
+        client = OlaClientPool()
     elif args.output == "artnet":
         client = ArtNetClient()
         client.set_port_config(1, isinput=True)
@@ -30,6 +33,10 @@ def build_show(args) -> Controller:
     controller = Controller(update_interval=25)
     if client:
         controller.add_network(client)
+    if isinstance(client, (OlaClient, OlaClientPool)):
+        controller.add_pollable(OlaDiscovery(client, controller.nodes))
+        if args.verify:
+            controller.add_pollable(ReadbackVerifier(client))
 
     if args.midi_in:
         midiin, port_name = open_midiinput(port="MPK")
@@ -71,48 +78,33 @@ def build_show(args) -> Controller:
     noise.o6.bind(col.i6)
     noise.o7.bind(col.i7)
 
-    col.o0.bind(par0.wash)
-    col.o1.bind(mini0.wash)
-    col.o2.bind(par1.wash)
-    col.o3.bind(mini1.wash)
-    col.o4.bind(par2.wash)
-    col.o5.bind(mini2.wash)
-    col.o6.bind(par3.wash)
-    col.o7.bind(mini3.wash)
-
+    # static colour underneath, interpolated colour composited on top
     static = StaticColour()
-    for f in [mini0, par0, mini1, par1, mini2, par2, mini3, par3]:
-        static.c0.bind(f.wash)
+    washes = [par0, mini0, par1, mini1, par2, mini2, par3, mini3]
+    for i, f in enumerate(washes):
+        stack = controller.add_layer_stack(f.wash)
+        static.c0.bind(stack.add_layer(priority=0).trait)
+        col._outputs[i].bind(stack.add_layer(priority=1, mode="max").trait)
     controller.add_efx(static)
 
     static_cw = StaticCopy(of_trait=mini0.spot_cw)
     static_gobo = StaticCopy(of_trait=mini0.spot_gobo)
-    # 300ms blackout for worst case wheel changes
-    sensitivty = []
-    for f in [mini0, mini1, mini2, mini3]:
-        sensitivty.append([f.spot_cw, f.spot_gobo])
-
-    cib = ChangeInBlack(channels=4, changes=sensitivty, blackout=0.3)
+    # spots go dark while their wheels turn, 300ms (Fixture.wheel_travel)
+    # covers the worst case wheel change
+    controller.add_output_stage(MoveInBlack())
 
     noise = PerlinNoiseEFX(count=4, trunc=0.3)
     controller.add_efx(noise)
-    noise.o0.bind(cib.i0)
-    noise.o1.bind(cib.i1)
-    noise.o2.bind(cib.i2)
-    noise.o3.bind(cib.i3)
+    static = StaticColour(trait_type=IntensityChannel)
 
     for i, f in enumerate([mini0, mini1, mini2, mini3]):
         static_cw.c0.bind(f.spot_cw)
         static_gobo.c0.bind(f.spot_gobo)
-        cib._outputs[i].bind(f.spot)
+        noise._outputs[i].bind(f.spot)
+        static.c0.bind(f.spot)
 
-    controller.add_efx(cib)
     controller.add_efx(static_cw)
     controller.add_efx(static_gobo)
-
-    static = StaticColour(trait_type=IntensityChannel)
-    for i2 in cib._inputs:
-        static.c0.bind(i2)
     controller.add_efx(static)
 
     cp = CosPulseEFX(channels=8)
@@ -127,6 +119,11 @@ def build_show(args) -> Controller:
 
     controller.add_efx(cp)
 
+    if args.audio:
+        s2l = SoundToLight(open_audio(args.audio))
+        controller.add_efx(s2l)
+        s2l.start()
+
     p = PositionIndexer(is_global=True, presets=4)
     controller.add_efx(p)
     p.o0.bind(mini0.pos)
@@ -146,9 +143,18 @@ if __name__ == "__main__":
     parser.add_argument("--cli", action="store_true")
 
     parser.add_argument("--old", action="store_false")
-    parser.add_argument("--output", choices=["ola", "artnet"], default="ola")
+    parser.add_argument(
+        "--output", choices=["ola", "ola-pool", "artnet"], default="ola"
+    )
+    parser.add_argument("--audio", help="WAV file, or - or a named pipe for raw PCM")
+    parser.add_argument(
+        "--verify", action="store_true", help="read universes back from olad"
+    )
 
     args = parser.parse_args()
+    if args.cli and args.audio == "-":
+        # textual reads the keyboard from stdin
+        parser.error("--audio - cannot be used with --cli, use a named pipe")
 
     controller = build_show(args)
     controller.load_showfile("showfile.json")